@@ -0,0 +1,154 @@
+import argparse
+import asyncio
+import csv
+import sys
+
+import aiohttp
+
+from cache import DistanceCache
+from courses import TourCache
+from graph import DistanceMatrix, create_graph
+from main import (add_planning_arguments, configs, create_fetcher,
+                  create_provider, get_excursions, parse_start_date,
+                  plan_stops, stream_course)
+from profiling import profiler
+
+
+async def plan_batch(manifest, solver="brute_force", distance_cache=None,
+                     gazetteer=None):
+    """
+    Функция, рассчитывающая маршруты для всех поездок из файла заданий
+    в одном процессе: общий граф строится один раз для объединения городов
+    всех поездок, а сессия, хранилище и источник расстояний общие,
+    поэтому каждое расстояние и список городов между двумя городами
+    запрашиваются один раз на весь запуск. Маршрут каждой поездки
+    записывается в файл по мере расчёта, ошибка одного задания
+    не прерывает остальные. Если общий граф построить не удалось,
+    каждая поездка строит свой граф по своим городам
+
+    :param manifest: Путь к csv файлу с колонками input_file, starting_city,
+            start_date, output_file
+    :param solver: Название способа поиска оптимального маршрута
+    :param distance_cache: Путь к хранилищу расстояний, может отсутствовать
+    :param gazetteer: Путь к файлу координат городов, может отсутствовать
+    :return: Список результатов в порядке заданий: количество записанных
+            городов маршрута либо исключение, из-за которого задание
+            не выполнено
+    """
+    jobs = read_manifest(manifest)
+    excursions = {}
+    results = [None] * len(jobs)
+    cities = []
+    for index, job in enumerate(jobs):
+        try:
+            if job['input_file'] not in excursions:
+                excursions[job['input_file']] = \
+                    get_excursions(job['input_file'])
+        except JOB_ERRORS as e:
+            results[index] = report_failure(job, e)
+            continue
+        for city in [i.city for i in excursions[job['input_file']]] \
+                + [job['starting_city']]:
+            if city not in cities:
+                cities.append(city)
+    cache = None
+    if distance_cache and not gazetteer:
+        cache = DistanceCache(distance_cache, configs['cache ttl'])
+    async with create_fetcher() as fetcher:
+        provider = create_provider(gazetteer, fetcher, cache)
+        try:
+            with profiler.stage('create_graph'):
+                graph = DistanceMatrix.from_graph(
+                    await create_graph(cities, cache, provider))
+        except JOB_ERRORS as e:
+            print('Shared graph failed, planning jobs separately: {!r}'
+                  .format(e), file=sys.stderr)
+            graph = None
+        tours = TourCache(configs['tour cache size'], cache)
+        planned = [index for index, result in enumerate(results)
+                   if result is None]
+        counts = await asyncio.gather(*[
+            plan_job(jobs[index], excursions[jobs[index]['input_file']],
+                     graph, solver, cache, provider, tours)
+            for index in planned])
+    if cache:
+        cache.close()
+    for index, count in zip(planned, counts):
+        results[index] = count
+    return results
+
+
+async def plan_job(job, excursions, graph, solver, cache, provider, tours):
+    """
+    Функция, рассчитывающая маршрут одной поездки и записывающая его
+    в выходной файл задания по мере расстановки городов
+
+    :param job: Задание из файла заданий
+    :param excursions: Список экскурсий поездки
+    :param graph: Общая матрица расстояний DistanceMatrix, если None,
+            граф строится только по городам поездки
+    :param solver: Название способа поиска оптимального маршрута
+    :param cache: Хранилище расстояний DistanceCache, может отсутствовать
+    :param provider: Источник DistanceProvider
+    :param tours: Хранилище найденных маршрутов TourCache
+    :return: Количество записанных городов либо исключение,
+            если задание не выполнено
+    """
+    try:
+        if graph is None:
+            cities = [i.city for i in excursions] + [job['starting_city']]
+            with profiler.stage('create_graph'):
+                graph = DistanceMatrix.from_graph(await create_graph(
+                    list(dict.fromkeys(cities)), cache, provider))
+        return await stream_course(
+            plan_stops(excursions, job['starting_city'], graph,
+                       *parse_start_date(job['start_date']), solver,
+                       provider, tours), job['output_file'])
+    except JOB_ERRORS as e:
+        return report_failure(job, e)
+
+
+def report_failure(job, error):
+    """
+    :param job: Задание из файла заданий
+    :param error: Исключение, из-за которого задание не выполнено
+    :return: То же исключение
+    """
+    print('Job {} failed: {!r}'.format(job['output_file'], error),
+          file=sys.stderr)
+    return error
+
+
+def read_manifest(manifest):
+    """
+    :param manifest: Путь к csv файлу заданий
+    :return: Список заданий в виде словарей
+    """
+    with open(manifest) as csvfile:
+        return list(csv.DictReader(csvfile))
+
+
+async def main():
+    """
+    Функция, запускающая расчёт маршрутов для файла заданий,
+    переданного в командной строке
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest")
+    add_planning_arguments(parser)
+    args = parser.parse_args()
+    if args.profile:
+        profiler.enable()
+    results = await plan_batch(args.manifest, args.solver,
+                               args.distance_cache, args.gazetteer)
+    if args.profile:
+        profiler.dump(args.profile)
+    if any(isinstance(i, Exception) for i in results):
+        sys.exit(1)
+
+
+JOB_ERRORS = (ValueError, KeyError, IndexError, TypeError, OSError,
+              aiohttp.ClientError, asyncio.TimeoutError)
+if __name__ == "__main__":
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main())
@@ -0,0 +1,47 @@
+"""
+Замер времени разбора одной страницы полным деревом BeautifulSoup
+и быстрыми функциями модуля parsing на сохранённых страницах
+
+Запуск из корня проекта: python -m benchmarks.bench_parsing
+"""
+import timeit
+
+from bs4 import BeautifulSoup
+
+from parsing import parse_corridor, parse_drive_distance
+
+
+def full_drive_distance(html):
+    return BeautifulSoup(html, 'html.parser').find(id="drivedist")
+
+
+def full_corridor(html):
+    return BeautifulSoup(html, 'html.parser').find_all(class_="cityinfo")
+
+
+def measure(func, html, number=20):
+    """
+    :param func: Функция разбора страницы
+    :param html: Текст страницы
+    :param number: Количество повторов
+    :return: Среднее время разбора одной страницы в миллисекундах
+    """
+    return min(timeit.repeat(lambda: func(html), number=number,
+                             repeat=3)) / number * 1000
+
+
+def main():
+    for fixture, full, fast in (
+            ('travelmath.html', full_drive_distance, parse_drive_distance),
+            ('citiesbetween.html', full_corridor, parse_corridor)):
+        with open('tests/fixtures/' + fixture) as f:
+            html = f.read()
+        full_time = measure(full, html)
+        fast_time = measure(fast, html)
+        print('{}: BeautifulSoup {:.3f} ms, {} {:.3f} ms, x{:.1f}'.format(
+            fixture, full_time, fast.__name__, fast_time,
+            full_time / fast_time))
+
+
+if __name__ == "__main__":
+    main()
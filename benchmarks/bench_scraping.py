@@ -0,0 +1,75 @@
+"""
+Замер построения графа через ScrapingProvider на локальном сервере
+с записанными страницами при разных ограничениях одновременных
+запросов к одному сайту, а также повторного построения с хранилищем
+
+Запуск из корня проекта: python -m benchmarks.bench_scraping
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from cache import DistanceCache
+from fetcher import Fetcher
+from graph import create_graph
+from profiling import profiler
+from providers import ScrapingProvider
+from standin import StandinServer
+
+
+async def measure(server, cities, limit_per_host, args, cache=None):
+    """
+    :param server: Запущенный сервер StandinServer
+    :param cities: Список городов графа
+    :param limit_per_host: Максимальное количество одновременных запросов
+    :param args: Параметры командной строки с повторами и дублированием
+    :param cache: Хранилище DistanceCache, может отсутствовать
+    :return: Время построения графа в секундах
+    """
+    start = time.perf_counter()
+    async with Fetcher(limit_per_host, args.timeout, args.retries, 0.05,
+                       args.hedge) as fetcher:
+        provider = ScrapingProvider(fetcher, cache, server.distance_url,
+                                    server.corridor_url)
+        await create_graph(cities, cache, provider)
+    return time.perf_counter() - start
+
+
+async def run(args):
+    cities = ['City{}'.format(i) for i in range(args.cities)]
+    profiler.enable()
+    async with StandinServer(latency=args.latency, jitter=args.jitter,
+                             error_rate=args.error_rate, seed=0) as server:
+        for limit in (1, 4, 8, 16, 32):
+            elapsed = await measure(server, cities, limit, args)
+            print('limit per host {}: {:.3f} s'.format(limit, elapsed))
+        with tempfile.TemporaryDirectory() as directory:
+            cache = DistanceCache(os.path.join(directory, 'cache.sqlite'))
+            cold = await measure(server, cities, 8, args, cache)
+            warm = await measure(server, cities, 8, args, cache)
+            cache.close()
+        print('cache: cold {:.3f} s, warm {:.3f} s'.format(cold, warm))
+        print('server: {} requests, {} errors'.format(server.requests,
+                                                      server.errors))
+    print(profiler.report()['counters'])
+    for host, stats in profiler.report()['http'].items():
+        print('{}: mean {:.3f} s, p95 {:.3f} s, max {:.3f} s'.format(
+            host, stats['mean'], stats['p95'], stats['max']))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cities", type=int, default=12)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--hedge", action="store_true")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
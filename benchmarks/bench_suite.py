@@ -0,0 +1,240 @@
+"""
+Набор замеров времени поиска маршрута, расстановки промежуточных городов
+и чтения/записи файлов на синтетических данных с сохранёнными
+базовыми результатами. Замер, медиана времени которого стала больше
+базовой больше чем в tolerance раз, либо давший другую длину маршрута,
+считается регрессией, и запуск завершается с ошибкой. Время чтения
+и записи файлов зависит от диска сильнее, чем от кода, поэтому эти замеры
+повторяются чаще и сравниваются с допуском io_tolerance
+
+Запуск из корня проекта: python -m benchmarks.bench_suite
+Обновление базовых результатов: python -m benchmarks.bench_suite --update
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import mock
+
+from courses import (SOLVERS, brute_force_course, count_course,
+                     create_courses)
+from excursions import Excursion, ExcursionCatalogue
+from main import (City, complete_course, create_course_with_middle_cities,
+                  get_excursions, write_course)
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+MIN_TIME = 0.01
+REPEAT = 5
+IO_REPEAT = 15
+
+
+def synthetic_graph(size, seed=0):
+    """
+    Создание графа в формате функции create_graph для городов
+    в случайных точках плоскости, расстояния между которыми
+    удовлетворяют неравенству треугольника
+
+    :param size: Количество городов
+    :param seed: Начальное значение генератора случайных чисел
+    :return: Список городов и матрица расстояний между ними
+    """
+    generator = random.Random(seed)
+    cities = ['City{}'.format(i) for i in range(size)]
+    points = [(generator.uniform(0, 900), generator.uniform(0, 900))
+              for i in cities]
+    graph = dict()
+    for i, city in enumerate(cities[:size - 1]):
+        graph[city] = {cities[j]: round(math.dist(points[i], points[j]) + 1)
+                       for j in range(i + 1, size)}
+    return cities, graph
+
+
+def synthetic_excursions(cities, seed=0):
+    """
+    :param cities: Список городов с экскурсиями
+    :param seed: Начальное значение генератора случайных чисел
+    :return: Список экскурсий ExcursionCatalogue по одной на город
+    """
+    generator = random.Random(seed)
+    excursions = []
+    for city in cities:
+        times = sorted(generator.sample(range(8, 20), 3))
+        excursions.append(Excursion('Tour ' + city, city, ', '.join(
+            '{:02}:00'.format(i) for i in times),
+            '{}h'.format(generator.randint(1, 4))))
+    return ExcursionCatalogue(excursions)
+
+
+def measure(func, repeat=REPEAT):
+    """
+    :param func: Замеряемая функция без параметров
+    :param repeat: Количество повторов
+    :return: Медиана времени выполнения в секундах и результат функции
+    """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def bench_create_courses(size):
+    cities, graph = synthetic_graph(size)
+
+    def run():
+        return min(count_course([cities[0]] + i, graph)
+                   for i in create_courses(cities[1:]))
+    return run
+
+
+def bench_solver(solver, size):
+    cities, graph = synthetic_graph(size)
+
+    def run():
+        return count_course(SOLVERS[solver](cities[1:], cities[0], graph),
+                            graph)
+    return run
+
+
+def bench_middle_cities(size, latency):
+    """
+    Замер расстановки промежуточных городов, в котором запрос списка
+    городов между двумя городами заменён ожиданием latency секунд
+    """
+    cities, graph = synthetic_graph(size)
+    excursions = synthetic_excursions(cities[1:])
+    course = brute_force_course(cities[1:], cities[0], graph) \
+        if size < 10 else SOLVERS['held_karp'](cities[1:], cities[0], graph)
+
+    async def find_middle_city(start_city, end_city, max_driving_distance,
+                               provider=None):
+        await asyncio.sleep(latency)
+        return [start_city + '-' + end_city, max_driving_distance * 0.9]
+
+    async def plan():
+        stops, parameters = await create_course_with_middle_cities(
+            course, excursions, graph, 480)
+        return await complete_course(stops, parameters[0], parameters[1],
+                                     cities[0], graph)
+
+    def run():
+        with mock.patch('main.find_middle_city', find_middle_city):
+            return len(asyncio.run(plan()))
+    return run
+
+
+def bench_get_excursions(directory, rows):
+    path = os.path.join(directory, 'excursions.csv')
+    with open(path, 'w') as f:
+        f.write('Name,City,Start time,Duration\n')
+        for i in range(rows):
+            f.write('Tour {0},City{0},"09:00, 13:30, 18:00",2h\n'.format(i))
+
+    def run():
+        return len(get_excursions(path))
+    return run
+
+
+def bench_write_course(directory, rows):
+    path = os.path.join(directory, 'output.csv')
+    course = [City('City{}'.format(i), None, None, 'Stopping point')
+              for i in range(rows)]
+
+    def run():
+        write_course(course, path)
+        return rows
+    return run
+
+
+def create_cases(directory, latency):
+    """
+    :param directory: Папка для временных файлов
+    :param latency: Задержка запроса списка городов в секундах
+    :return: Список из названия замера, замеряемой функции и признака
+            замера чтения или записи файла
+    """
+    cases = [('create_courses/count_course {}'.format(i),
+              bench_create_courses(i)) for i in range(5, 10)]
+    cases += [('brute_force {}'.format(i), bench_solver('brute_force', i))
+              for i in range(5, 11)]
+    for solver in ('held_karp', 'branch_and_bound', 'heuristic'):
+        cases += [('{} {}'.format(solver, i), bench_solver(solver, i))
+                  for i in range(5, 14)]
+    cases += [('middle cities {} ({} ms)'.format(i, latency * 1000),
+               bench_middle_cities(i, latency)) for i in (5, 9, 13)]
+    cases = [(name, func, False) for name, func in cases]
+    cases += [('get_excursions 50000', bench_get_excursions(directory, 50000),
+               True),
+              ('write_course 50000', bench_write_course(directory, 50000),
+               True)]
+    return cases
+
+
+def compare(results, baseline, tolerance, io_tolerance=None):
+    """
+    Функция, сравнивающая результаты замеров с базовыми
+
+    :param results: Словарь замеров: время в секундах, результат
+            и необязательный признак замера чтения или записи файла io
+    :param baseline: Словарь базовых замеров в том же формате
+    :param tolerance: Во сколько раз замер может быть медленнее базового,
+            базовое время меньше MIN_TIME считается равным MIN_TIME
+    :param io_tolerance: Допуск для замеров чтения или записи файла,
+            по умолчанию tolerance
+    :return: Список описаний регрессий
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        allowed = io_tolerance if result.get('io') and io_tolerance \
+            else tolerance
+        if result['value'] != baseline[name]['value']:
+            regressions.append('{}: result {} instead of {}'.format(
+                name, result['value'], baseline[name]['value']))
+        elif result['time'] > max(baseline[name]['time'],
+                                  MIN_TIME) * allowed:
+            regressions.append('{}: {:.4f} s instead of {:.4f} s'.format(
+                name, result['time'], baseline[name]['time']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--update", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=2.0)
+    parser.add_argument("--io_tolerance", type=float, default=4.0)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--baseline", default=BASELINE)
+    args = parser.parse_args()
+    results = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        for name, func, io in create_cases(directory, args.latency):
+            elapsed, value = measure(func, IO_REPEAT if io else REPEAT)
+            results[name] = {'time': elapsed, 'value': value}
+            if io:
+                results[name]['io'] = True
+            print('{}: {:.4f} s'.format(name, elapsed))
+    if args.update:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=1)
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance,
+                          args.io_tolerance)
+    if regressions:
+        print('Regressions:', *regressions, sep='\n', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
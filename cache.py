@@ -0,0 +1,138 @@
+import json
+import sqlite3
+import time
+
+from profiling import profiler
+
+
+class DistanceCache:
+    """
+    Класс хранящий расстояния между городами в файле SQLite,
+    ключом служит неупорядоченная пара городов.
+    Также хранит списки городов между двумя городами
+    и оптимальные замкнутые маршруты
+    """
+
+    def __init__(self, path, ttl=30):
+        """
+        :param path: Путь к файлу базы данных
+        :param ttl: Срок хранения расстояния в днях
+        """
+        self.ttl = ttl * 24 * 60 * 60
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS distances ('
+            'first_city TEXT, second_city TEXT, distance REAL, fetched REAL, '
+            'PRIMARY KEY (first_city, second_city))')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS corridors ('
+            'start_city TEXT, end_city TEXT, cities TEXT, fetched REAL, '
+            'PRIMARY KEY (start_city, end_city))')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS tours ('
+            'key TEXT PRIMARY KEY, cities TEXT)')
+
+    def get_many(self, pairs):
+        """
+        Функция, возвращающая все не устаревшие расстояния
+        между переданными парами городов одним запросом на каждые
+        CHUNK_SIZE пар
+
+        :param pairs: Список пар городов
+        :return: Словарь пара городов - расстояние, только для найденных пар
+        """
+        keys = {create_key(*i): i for i in pairs}
+        distances = {}
+        items = list(keys)
+        for index in range(0, len(items), CHUNK_SIZE):
+            chunk = items[index:index + CHUNK_SIZE]
+            rows = self.connection.execute(
+                'SELECT first_city, second_city, distance FROM distances '
+                'WHERE fetched >= ? AND (first_city, second_city) IN '
+                '(VALUES ' + ', '.join(['(?, ?)'] * len(chunk)) + ')',
+                [time.time() - self.ttl] + [j for i in chunk for j in i])
+            for first_city, second_city, distance in rows:
+                distances[keys[first_city, second_city]] = distance
+        profiler.count('distance cache hits', len(distances))
+        profiler.count('distance cache misses', len(keys) - len(distances))
+        return distances
+
+    def put_many(self, distances):
+        """
+        Функция, сохраняющая переданные расстояния
+
+        :param distances: Список из начального города, конечного города
+                и расстояния между ними
+        """
+        fetched = time.time()
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO distances VALUES (?, ?, ?, ?)',
+                [create_key(i[0], i[1]) + (i[2], fetched) for i in distances])
+
+    def get_corridor(self, start_city, end_city):
+        """
+        Функция, возвращающая не устаревший список городов между двумя городами
+
+        :param start_city: Город, откуда выезжаем
+        :param end_city: Город, куда едем
+        :return: Названия городов и расстояния до них от start_city,
+                либо None, если списка нет
+        """
+        row = self.connection.execute(
+            'SELECT cities FROM corridors WHERE start_city = ? '
+            'AND end_city = ? AND fetched >= ?',
+            (start_city, end_city, time.time() - self.ttl)).fetchone()
+        profiler.count('corridor cache hits' if row
+                       else 'corridor cache misses')
+        return json.loads(row[0]) if row else None
+
+    def put_corridor(self, start_city, end_city, names, distances):
+        """
+        Функция, сохраняющая список городов между двумя городами
+
+        :param start_city: Город, откуда выезжаем
+        :param end_city: Город, куда едем
+        :param names: Названия городов между ними
+        :param distances: Расстояния до этих городов от start_city
+        """
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO corridors VALUES (?, ?, ?, ?)',
+                (start_city, end_city, json.dumps([names, distances]),
+                 time.time()))
+
+    def get_tour(self, key):
+        """
+        :param key: Ключ маршрута из функции TourCache.create_key
+        :return: Замкнутый маршрут, либо None, если его нет
+        """
+        row = self.connection.execute(
+            'SELECT cities FROM tours WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_tour(self, key, course):
+        """
+        :param key: Ключ маршрута из функции TourCache.create_key
+        :param course: Замкнутый маршрут
+        """
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO tours VALUES (?, ?)',
+                (key, json.dumps(course)))
+
+    def close(self):
+        self.connection.close()
+
+
+def create_key(start_city, end_city):
+    """
+    :param start_city: Город, откуда выезжаем
+    :param end_city: Город, куда едем
+    :return: Пара городов, не зависящая от направления поездки
+    """
+    return (start_city, end_city) if start_city <= end_city \
+        else (end_city, start_city)
+
+
+CHUNK_SIZE = 400
@@ -1,4 +1,13 @@
+import collections
+import concurrent.futures
 import copy
+import itertools
+import math
+
+import numpy as np
+
+from graph import DistanceMatrix, get_distance
+from profiling import profiler
 
 
 def create_courses(cities: list):
@@ -27,13 +36,475 @@ def count_course(course, graph):
     :param course: Маршрут, для оценки
     :return: Длина переданного маршрута
     """
-    if course[0] in graph and course[len(course) - 1] in graph[course[0]]:
-        distance = graph[course[0]][course[len(course) - 1]]
-    else:
-        distance = graph[course[len(course) - 1]][course[0]]
+    distance = get_distance(graph, course[0], course[len(course) - 1])
     for index, i in enumerate(course[:len(course) - 1]):
-        if i in graph and course[index + 1] in graph[i]:
-            distance += graph[i][course[index + 1]]
-        else:
-            distance += graph[course[index + 1]][i]
+        distance += get_distance(graph, i, course[index + 1])
     return distance
+
+
+def brute_force_course(cities, starting_city, graph):
+    """
+    Функция, находящая оптимальный маршрут полным перебором
+    всех расстановок городов функцией enumerate_tours
+
+    :param cities: Список городов с экскурсиями
+    :param starting_city: Стартовый город маршрута
+    :param graph: Матрица расстояний между городами
+    :return: Оптимальный маршрут, начинающийся в стартовом городе
+    """
+    points = [starting_city] + list(cities)
+    matrix = DistanceMatrix.from_graph(graph).submatrix(points).tolist()
+    distance, course = find_shortest_tour(enumerate_tours(matrix))
+    profiler.count('permutations', count_tours(len(cities)))
+    return [points[i] for i in course]
+
+
+def enumerate_tours(matrix, pairs=None):
+    """
+    Генератор, перебирающий замкнутые маршруты из стартового города
+    без копирования списков: расстановки строятся обменами элементов
+    одного списка, а длина считается по префиксным суммам длин, поэтому
+    при каждом обмене пересчитывается одно ребро.
+    Стартовый город всегда первый, а первый город после него меньше
+    последнего, поэтому каждый маршрут и маршрут в обратном
+    направлении выдаются один раз
+
+    :param matrix: Двумерный список расстояний, стартовый город под индексом 0
+    :param pairs: Пары первого и последнего города после стартового,
+            по умолчанию все пары
+    :return: Длина маршрута и маршрут из индексов городов. Маршрут меняется
+            при следующей итерации, его нужно копировать
+    """
+    size = len(matrix)
+    if size == 2:
+        yield matrix[0][1] + matrix[1][0], [0, 1]
+        return
+    end = size - 1
+    prefix = [0] * size
+    choice = [0] * size
+    for first, last in pairs or itertools.combinations(range(1, size), 2):
+        course = [0, first] + [i for i in range(1, size)
+                               if i != first and i != last] + [last]
+        prefix[1] = matrix[0][first]
+        closing = matrix[last][0]
+        position = 2
+        choice[2] = 2
+        while position > 1:
+            if position == end:
+                yield prefix[end - 1] + matrix[course[end - 1]][last] \
+                    + closing, course
+                position -= 1
+                continue
+            j = choice[position]
+            if j > position:
+                course[position], course[j - 1] = \
+                    course[j - 1], course[position]
+            if j == end:
+                position -= 1
+                continue
+            course[position], course[j] = course[j], course[position]
+            prefix[position] = prefix[position - 1] \
+                + matrix[course[position - 1]][course[position]]
+            choice[position] = j + 1
+            position += 1
+            choice[position] = position
+
+
+def count_tours(size):
+    """
+    :param size: Количество городов без стартового
+    :return: Количество маршрутов, перебираемых функцией enumerate_tours
+    """
+    return max(math.factorial(size) // 2, 1)
+
+
+def find_shortest_tour(tours):
+    """
+    :param tours: Пары из длины маршрута и маршрута
+    :return: Длина и копия первого из кратчайших маршрутов
+    """
+    min_distance = math.inf
+    current_course = None
+    for distance, course in tours:
+        if distance < min_distance:
+            current_course = list(course)
+            min_distance = distance
+    return min_distance, current_course
+
+
+def held_karp_course(cities, starting_city, graph):
+    """
+    Функция, находящая оптимальный маршрут алгоритмом Хелда-Карпа:
+    динамическим программированием по подмножествам посещённых городов,
+    за O(n^2 * 2^n) вместо O(n! * n) у полного перебора.
+    Подмножества одного размера обрабатываются одной операцией numpy
+
+    :param cities: Список городов с экскурсиями
+    :param starting_city: Стартовый город маршрута
+    :param graph: Матрица расстояний между городами
+    :return: Оптимальный маршрут, начинающийся в стартовом городе
+    """
+    size = len(cities)
+    points = [starting_city] + list(cities)
+    matrix = DistanceMatrix.from_graph(graph).submatrix(points)
+    from_start = matrix[0, 1:]
+    between = matrix[1:, 1:]
+    costs = np.full((1 << size, size), np.inf)
+    parents = np.full((1 << size, size), -1, dtype=np.int8)
+    for j in range(size):
+        costs[1 << j, j] = from_start[j]
+    masks = np.arange(1 << size)
+    popcount = np.zeros(1 << size, dtype=np.int8)
+    for j in range(size):
+        popcount += (masks >> j) & 1
+    for subset_size in range(2, size + 1):
+        layer = masks[popcount == subset_size]
+        for j in range(size):
+            current = layer[(layer >> j) & 1 == 1]
+            previous = current ^ (1 << j)
+            candidates = costs[previous] + between[:, j]
+            parents[current, j] = candidates.argmin(axis=1)
+            costs[current, j] = candidates[np.arange(len(current)),
+                                           parents[current, j]]
+    full = (1 << size) - 1
+    last = int((costs[full] + matrix[1:, 0]).argmin())
+    course = []
+    mask = full
+    while last != -1:
+        course.append(points[last + 1])
+        mask, last = mask ^ (1 << last), int(parents[mask, last])
+    course.append(starting_city)
+    course.reverse()
+    return course
+
+
+def branch_and_bound_course(cities, starting_city, graph):
+    """
+    Функция, находящая оптимальный маршрут методом ветвей и границ:
+    поиском в глубину, продлевающим частичный маршрут, с отсечением ветвей,
+    у которых текущая длина вместе с нижней оценкой остатка пути
+    не меньше длины лучшего найденного маршрута.
+    Нижняя оценка остатка пути - ребро до ближайшего непосещённого города
+    и минимальное остовное дерево на непосещённых городах и стартовом
+
+    :param cities: Список городов с экскурсиями
+    :param starting_city: Стартовый город маршрута
+    :param graph: Матрица расстояний между городами
+    :return: Оптимальный маршрут, начинающийся в стартовом городе
+    """
+    points = [starting_city] + list(cities)
+    matrix = DistanceMatrix.from_graph(graph).submatrix(points).tolist()
+    nearest = [sorted(range(1, len(points)), key=i.__getitem__)
+               for i in matrix]
+    best_course = greedy_course(matrix)
+    best = [sum(matrix[i][j] for i, j
+                in zip(best_course, best_course[1:] + best_course[:1]))]
+    trees = {}
+    course = [0]
+
+    def extend(last, unvisited, cost):
+        if not unvisited:
+            cost += matrix[last][0]
+            if cost < best[0]:
+                best[0] = cost
+                best_course[:] = course
+            return
+        if unvisited not in trees:
+            trees[unvisited] = spanning_tree(matrix, unvisited)
+        bound = cost + trees[unvisited] + min(
+            matrix[last][i] for i in nearest[last] if unvisited >> i & 1)
+        if bound >= best[0]:
+            return
+        for i in nearest[last]:
+            if unvisited >> i & 1:
+                course.append(i)
+                extend(i, unvisited ^ (1 << i), cost + matrix[last][i])
+                course.pop()
+
+    extend(0, (1 << len(points)) - 2, 0)
+    return [points[i] for i in best_course]
+
+
+def greedy_course(matrix):
+    """
+    Функция, строящая маршрут из стартового города жадно:
+    каждый раз едем в ближайший непосещённый город
+
+    :param matrix: Двумерный список расстояний, стартовый город под индексом 0
+    :return: Маршрут из индексов городов
+    """
+    course = [0]
+    unvisited = set(range(1, len(matrix)))
+    while unvisited:
+        following = min(unvisited, key=matrix[course[-1]].__getitem__)
+        unvisited.remove(following)
+        course.append(following)
+    return course
+
+
+def spanning_tree(matrix, unvisited):
+    """
+    Функция, находящая вес минимального остовного дерева алгоритмом Прима
+    на стартовом городе и городах из переданной маски
+
+    :param matrix: Двумерный список расстояний, стартовый город под индексом 0
+    :param unvisited: Битовая маска городов
+    :return: Вес минимального остовного дерева
+    """
+    nodes = [i for i in range(len(matrix)) if unvisited >> i & 1]
+    distances = {i: matrix[0][i] for i in nodes}
+    weight = 0
+    while distances:
+        node = min(distances, key=distances.__getitem__)
+        weight += distances.pop(node)
+        for i in distances:
+            if matrix[node][i] < distances[i]:
+                distances[i] = matrix[node][i]
+    return weight
+
+
+def heuristic_course(cities, starting_city, graph):
+    """
+    Функция, находящая близкий к оптимальному маршрут для большого числа
+    городов: маршрут строится жадно от стартового города и улучшается
+    локальным поиском 2-opt и Or-opt, пока есть улучшения
+
+    :param cities: Список городов с экскурсиями
+    :param starting_city: Стартовый город маршрута
+    :param graph: Матрица расстояний между городами
+    :return: Маршрут, начинающийся в стартовом городе
+    """
+    points = [starting_city] + list(cities)
+    matrix = DistanceMatrix.from_graph(graph).submatrix(points)
+    course = np.array(greedy_course(matrix.tolist()))
+    improved = True
+    while improved:
+        course, improved = two_opt(course, matrix)
+        course, moved = or_opt(course, matrix)
+        improved = improved or moved
+    course = np.roll(course, -int(np.flatnonzero(course == 0)[0]))
+    return [points[i] for i in course]
+
+
+def update_course(course, cities, starting_city, graph, passes=3):
+    """
+    Функция, перестраивающая найденный ранее маршрут после изменения
+    списка городов: убранные города удаляются из маршрута, каждый новый
+    вставляется между теми соседними городами, где удлиняет маршрут меньше
+    всего, после чего маршрут улучшается не более чем passes проходами
+    2-opt и Or-opt
+
+    :param course: Прежний маршрут, начинающийся в стартовом городе
+    :param cities: Новый список городов с экскурсиями
+    :param starting_city: Стартовый город маршрута
+    :param graph: Матрица расстояний, содержащая все новые города
+    :param passes: Максимальное количество проходов локального поиска
+    :return: Маршрут, начинающийся в стартовом городе
+    """
+    points = [starting_city] + list(cities)
+    matrix = DistanceMatrix.from_graph(graph).submatrix(points)
+    index = {city: i for i, city in reversed(list(enumerate(points)))}
+    tour = [0] + [index[i] for i in dict.fromkeys(course)
+                  if i in index and i != starting_city]
+    present = set(tour)
+    for city in range(1, len(points)):
+        if city in present:
+            continue
+        following = np.roll(tour, -1)
+        costs = matrix[tour, city] + matrix[city, following] \
+            - matrix[tour, following]
+        tour.insert(int(costs.argmin()) + 1, city)
+        present.add(city)
+    course = np.array(tour)
+    for i in range(passes):
+        course, improved = two_opt(course, matrix)
+        course, moved = or_opt(course, matrix)
+        if not (improved or moved):
+            break
+    course = np.roll(course, -int(np.flatnonzero(course == 0)[0]))
+    return [points[i] for i in course]
+
+
+def two_opt(course, matrix):
+    """
+    Функция, улучшающая замкнутый маршрут заменой пар рёбер (a, b), (c, d)
+    на (a, c), (b, d) с разворотом участка между ними.
+    Выигрыш каждой замены считается за O(1), для всех c сразу через numpy
+
+    :param course: Массив индексов городов маршрута
+    :param matrix: Массив расстояний между городами
+    :return: Улучшенный маршрут и признак того, что он изменился
+    """
+    size = len(course)
+    improved = False
+    for i in range(size - 2):
+        ends = np.arange(i + 2, size if i else size - 1)
+        if not len(ends):
+            continue
+        a, b = course[i], course[i + 1]
+        c, d = course[ends], course[(ends + 1) % size]
+        deltas = matrix[a, c] + matrix[b, d] - matrix[a, b] - matrix[c, d]
+        best = int(deltas.argmin())
+        if deltas[best] < -EPSILON:
+            j = ends[best]
+            course[i + 1:j + 1] = course[i + 1:j + 1][::-1]
+            improved = True
+    return course, improved
+
+
+def or_opt(course, matrix):
+    """
+    Функция, улучшающая замкнутый маршрут переносом участков
+    из 1, 2 или 3 городов, в прямом или обратном порядке,
+    между двумя другими соседними городами маршрута.
+    Выигрыш каждого переноса считается за O(1), для всех мест сразу через numpy
+
+    :param course: Массив индексов городов маршрута
+    :param matrix: Массив расстояний между городами
+    :return: Улучшенный маршрут и признак того, что он изменился
+    """
+    improved = False
+    for length in (1, 2, 3):
+        i = 0
+        while i < len(course) and len(course) > length + 2:
+            size = len(course)
+            segment = course[np.arange(i, i + length) % size]
+            previous = course[i - 1]
+            following = course[(i + length) % size]
+            removal = (matrix[previous, segment[0]]
+                       + matrix[segment[-1], following]
+                       - matrix[previous, following])
+            rest = np.roll(course, -(i + length))[:size - length]
+            left, right = rest[:-1], rest[1:]
+            gap = matrix[left, right]
+            forward = (matrix[left, segment[0]]
+                       + matrix[segment[-1], right] - gap)
+            backward = (matrix[left, segment[-1]]
+                        + matrix[segment[0], right] - gap)
+            insertion = np.minimum(forward, backward)
+            best = int(insertion.argmin())
+            if insertion[best] - removal < -EPSILON:
+                if backward[best] < forward[best]:
+                    segment = segment[::-1]
+                course = np.concatenate((rest[:best + 1], segment,
+                                         rest[best + 1:]))
+                improved = True
+            else:
+                i += 1
+    return course, improved
+
+
+def parallel_course(cities, starting_city, graph, workers=None):
+    """
+    Функция, находящая оптимальный маршрут полным перебором в нескольких
+    процессах. Расстановки делятся на части по первому и последнему городам
+    после стартового, каждая часть перебирается функцией enumerate_tours
+    в отдельном процессе по общей матрице расстояний. При равной длине
+    выбирается маршрут из более ранней части, поэтому результат
+    не зависит от порядка завершения процессов
+
+    :param cities: Список городов с экскурсиями
+    :param starting_city: Стартовый город маршрута
+    :param graph: Матрица расстояний между городами
+    :param workers: Количество процессов, по умолчанию по числу ядер
+    :return: Оптимальный маршрут, начинающийся в стартовом городе
+    """
+    if len(cities) < 3:
+        return brute_force_course(cities, starting_city, graph)
+    points = [starting_city] + list(cities)
+    matrix = DistanceMatrix.from_graph(graph).submatrix(points)
+    pairs = list(itertools.combinations(range(1, len(points)), 2))
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker,
+            initargs=(matrix.tolist(),)) as executor:
+        distance, course = find_shortest_tour(
+            executor.map(_count_shard, pairs))
+    profiler.count('permutations', count_tours(len(cities)))
+    return [points[i] for i in course]
+
+
+_worker_matrix = None
+
+
+def _init_worker(matrix):
+    global _worker_matrix
+    _worker_matrix = matrix
+
+
+def _count_shard(pair):
+    """
+    :param pair: Первый и последний города маршрута после стартового
+    :return: Длина кратчайшего из маршрутов с такими городами и сам маршрут
+    """
+    return find_shortest_tour(enumerate_tours(_worker_matrix, [pair]))
+
+
+EPSILON = 1e-9
+
+SOLVERS = {
+    'brute_force': brute_force_course,
+    'held_karp': held_karp_course,
+    'branch_and_bound': branch_and_bound_course,
+    'heuristic': heuristic_course,
+    'parallel': parallel_course,
+}
+
+
+class TourCache:
+    """
+    Класс хранящий найденные оптимальные замкнутые маршруты. Замкнутый
+    маршрут по множеству городов один и тот же при любом стартовом городе,
+    поэтому ключом служат способ поиска и хеш множества городов вместе
+    с расстояниями между ними, а сохранённый маршрут поворачивается
+    к нужному стартовому городу. В памяти хранятся size последних
+    использованных маршрутов, в хранилище, если оно передано, все
+    """
+
+    def __init__(self, size=256, store=None):
+        """
+        :param size: Количество маршрутов в памяти
+        :param store: Хранилище DistanceCache, может отсутствовать
+        """
+        self.size = size
+        self.store = store
+        self.tours = collections.OrderedDict()
+
+    def course(self, solver, cities, starting_city, graph):
+        """
+        Функция, возвращающая оптимальный маршрут из сохранённых,
+        либо находящая и сохраняющая его
+
+        :param solver: Название способа поиска оптимального маршрута
+        :param cities: Список городов с экскурсиями
+        :param starting_city: Стартовый город маршрута
+        :param graph: Матрица расстояний между городами
+        :return: Оптимальный маршрут, начинающийся в стартовом городе
+        """
+        matrix = DistanceMatrix.from_graph(graph)
+        key = self.create_key(solver, [starting_city] + list(cities), matrix)
+        tour = self.tours.get(key)
+        if tour is None and self.store:
+            tour = self.store.get_tour(key)
+        if tour is None:
+            profiler.count('tour cache misses')
+            tour = SOLVERS[solver](cities, starting_city, matrix)
+            if self.store:
+                self.store.put_tour(key, tour)
+        else:
+            profiler.count('tour cache hits')
+        self.tours[key] = tour
+        self.tours.move_to_end(key)
+        if len(self.tours) > self.size:
+            self.tours.popitem(last=False)
+        index = tour.index(starting_city)
+        return tour[index:] + tour[:index]
+
+    @staticmethod
+    def create_key(solver, cities, matrix):
+        """
+        :param solver: Название способа поиска оптимального маршрута
+        :param cities: Список городов маршрута
+        :param matrix: Матрица расстояний DistanceMatrix
+        :return: Ключ маршрута
+        """
+        return solver + ':' + matrix.fingerprint(cities)
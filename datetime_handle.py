@@ -18,3 +18,50 @@ def create_datetime(current_datetime: datetime.datetime,
                                            minutes=arrival_minutes,
                                            seconds=arrival_seconds)
     return current_datetime + arrival_timedelta
+
+
+MINUTES_IN_HOUR = 60
+MINUTES_IN_DAY = 24 * MINUTES_IN_HOUR
+
+
+def to_minutes(hours):
+    """
+    Функция, переводящая время в часах в целое число минут
+
+    :param hours: Время в часах
+    :return: Время в минутах
+    """
+    return round(hours * MINUTES_IN_HOUR)
+
+
+def time_of_day(clock):
+    """
+    :param clock: Время в минутах от полуночи первого дня поездки
+    :return: Время в минутах от полуночи текущего дня
+    """
+    return clock % MINUTES_IN_DAY
+
+
+def next_day(clock, minutes):
+    """
+    :param clock: Время в минутах от полуночи первого дня поездки
+    :param minutes: Время в минутах от полуночи
+    :return: Переданное время следующего дня в минутах
+            от полуночи первого дня поездки
+    """
+    return clock - clock % MINUTES_IN_DAY + MINUTES_IN_DAY + minutes
+
+
+def clock_to_datetime(current_datetime: datetime.datetime, clock):
+    """
+    Функция, переводящая время поездки в дату и время,
+    используется только при выдаче городов маршрута
+
+    :param current_datetime: Дата начала поездки в формате год, месяц, день
+    :param clock: Время в минутах от полуночи первого дня поездки,
+            может отсутствовать
+    :return: Дата и время либо None
+    """
+    if clock is None:
+        return None
+    return current_datetime + datetime.timedelta(minutes=clock)
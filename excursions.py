@@ -0,0 +1,89 @@
+import bisect
+import csv
+
+from datetime_handle import MINUTES_IN_HOUR
+
+
+class Excursion:
+    """
+    Класс хранящий информацию об экскурсии
+    """
+
+    def __init__(self, name, city, start_time, duration):
+        self.name = name
+        self.city = city
+        self.start_time = start_time
+        self.duration = duration
+
+
+class ExcursionSlots:
+    """
+    Класс хранящий разобранные данные экскурсии: отсортированные
+    времена начала в минутах от полуночи и длительность в минутах
+    """
+    __slots__ = ('name', 'times', 'duration')
+
+    def __init__(self, excursion):
+        self.name = excursion.name
+        times = []
+        for time in excursion.start_time.strip().split(','):
+            time = time.split(':')
+            times.append(int(time[0]) * MINUTES_IN_HOUR + int(time[1]))
+        self.times = sorted(times)
+        duration = excursion.duration
+        self.duration = int(duration[:len(duration) - 1]) * MINUTES_IN_HOUR
+
+    def next_start(self, arrival):
+        """
+        Функция, находящая бинарным поиском ближайшее время начала
+        экскурсии после приезда
+
+        :param arrival: Время приезда в минутах от полуночи
+        :return: Время начала экскурсии и признак того,
+                что экскурсия будет на следующий день
+        """
+        index = bisect.bisect_right(self.times, arrival)
+        if index < len(self.times):
+            return self.times[index], False
+        return self.times[0], True
+
+
+class ExcursionCatalogue(list):
+    """
+    Класс списка экскурсий, хранящий разобранные данные
+    первой экскурсии каждого города
+    """
+
+    def __init__(self, excursions=()):
+        super().__init__(excursions)
+        self.by_city = {}
+        for i in self:
+            if i.city not in self.by_city:
+                self.by_city[i.city] = ExcursionSlots(i)
+
+
+def read_excursions(input_file):
+    """
+    Функция, возвращающая список экскурсий из переданного файла
+
+    :param input_file: Путь к файлу, содержащему список экскурсий
+    :return: Список экскурсий ExcursionCatalogue
+    """
+    excursions = []
+    with open(input_file) as csvfile:
+        reader = csv.DictReader(csvfile)
+        for i in reader:
+            excursions.append(Excursion(i['Name'], i['City'],
+                                        i['Start time'], i['Duration']))
+    return ExcursionCatalogue(excursions)
+
+
+def get_excursion_slots(excursions, city):
+    """
+    :param excursions: Список экскурсий, ExcursionCatalogue либо обычный
+    :param city: Город с экскурсией
+    :return: Разобранные данные первой экскурсии в городе ExcursionSlots
+    """
+    if isinstance(excursions, ExcursionCatalogue):
+        return excursions.by_city[city]
+    return ExcursionSlots([i for i in excursions if i.city == city][0])
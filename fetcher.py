@@ -0,0 +1,164 @@
+import asyncio
+import collections
+import random
+import time
+import urllib.parse
+
+import aiohttp
+
+from profiling import profiler
+
+
+class Fetcher:
+    """
+    Класс хранящий общую сессию aiohttp с пулом соединений для всех
+    запросов к внешним сайтам за один расчёт маршрута и ограничивающий
+    количество одновременных запросов к одному сайту.
+    Запрос, не получивший ответа за timeout секунд после отправки либо
+    получивший ошибку сервера, повторяется до retries раз с паузой
+    со случайным разбросом. Время ожидания своей очереди к сайту
+    в timeout не входит.
+    Если включено дублирование, то запрос, не получивший ответа за время,
+    в которое укладываются 95% ответов этого сайта, отправляется ещё раз,
+    и используется первый полученный ответ
+    """
+
+    def __init__(self, limit_per_host=8, timeout=None, retries=0,
+                 backoff=0.5, hedge=False):
+        """
+        :param limit_per_host: Максимальное количество одновременных
+                запросов к одному сайту
+        :param timeout: Время ожидания ответа в секундах с момента
+                отправки запроса, без времени ожидания очереди к сайту,
+                по умолчанию без ограничения
+        :param retries: Количество повторов запроса после ошибки
+        :param backoff: Средняя пауза перед первым повтором в секундах,
+                перед каждым следующим она удваивается
+        :param hedge: Дублировать ли медленные запросы
+        """
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.semaphores = {}
+        self.latencies = {}
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit_per_host=self.limit_per_host)
+        self.session = aiohttp.ClientSession(connector=connector)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+
+    async def get_text(self, url):
+        """
+        Функция, запрашивающая страницу через общую сессию
+
+        :param url: Адрес страницы
+        :return: Текст страницы
+        """
+        host = urllib.parse.urlsplit(url).hostname
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(self.limit_per_host)
+        for attempt in range(self.retries + 1):
+            try:
+                return await self.get_first_text(host, url)
+            except (asyncio.TimeoutError, aiohttp.ClientError):
+                if attempt == self.retries:
+                    raise
+            profiler.count('retries')
+            await asyncio.sleep(self.backoff * 2 ** attempt
+                                * random.uniform(0.5, 1.5))
+
+    async def get_first_text(self, host, url):
+        """
+        Функция, запрашивающая страницу и, если включено дублирование,
+        повторяющая запрос, когда ответ дольше обычного
+
+        :param host: Сайт, к которому запрос
+        :param url: Адрес страницы
+        :return: Текст страницы из первого успешного ответа
+        """
+        delay = self.hedge_delay(host)
+        first = asyncio.ensure_future(self.request_text(host, url))
+        if delay is None:
+            return await first
+        tasks = {first}
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return first.result()
+            profiler.count('hedged requests')
+            tasks.add(asyncio.ensure_future(self.request_text(host, url)))
+            while True:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.exception() or not tasks:
+                        return task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def request_text(self, host, url):
+        """
+        Функция, отправляющая запрос, когда освободится место среди
+        limit_per_host одновременных запросов к сайту. Timeout и время
+        ответа для дублирования отсчитываются только с отправки запроса
+
+        :param host: Сайт, к которому запрос
+        :param url: Адрес страницы
+        :return: Текст страницы
+        """
+        async with self.semaphores[host]:
+            start = time.perf_counter()
+            text = await asyncio.wait_for(self.read_text(url), self.timeout)
+            latency = time.perf_counter() - start
+        self.latencies.setdefault(host, collections.deque(
+            maxlen=LATENCY_SAMPLES)).append(latency)
+        profiler.request(host, latency)
+        return text
+
+    async def read_text(self, url):
+        """
+        :param url: Адрес страницы
+        :return: Текст страницы, если сервер не ответил ошибкой
+        """
+        async with self.session.get(url) as response:
+            if response.status in RETRY_STATUSES:
+                response.raise_for_status()
+            return await response.text()
+
+    def hedge_delay(self, host):
+        """
+        :param host: Сайт, к которому запрос
+        :return: Время, в которое укладываются 95% последних ответов сайта,
+                либо None, если дублирование выключено или ответов мало
+        """
+        latencies = self.latencies.get(host, ())
+        if not self.hedge or len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return sorted(latencies)[int(0.95 * (len(latencies) - 1))]
+
+
+async def fetch_text(url, fetcher=None):
+    """
+    Функция, запрашивающая страницу через переданный Fetcher,
+    либо, если он не передан, через отдельную сессию
+
+    :param url: Адрес страницы
+    :param fetcher: Общая сессия Fetcher, может отсутствовать
+    :return: Текст страницы
+    """
+    if fetcher:
+        return await fetcher.get_text(url)
+    async with Fetcher() as fetcher:
+        return await fetcher.get_text(url)
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+LATENCY_SAMPLES = 200
+HEDGE_MIN_SAMPLES = 20
@@ -1,64 +1,197 @@
 import asyncio
+import hashlib
+import json
 
-import aiohttp
-from bs4 import BeautifulSoup
+import numpy as np
 
+from fetcher import fetch_text
+from parsing import parse_drive_distance
+from settings import configs
 
-async def create_graph(cities):
+
+class DistanceMatrix:
+    """
+    Класс хранящий симметричную матрицу расстояний между городами
+    в виде массива numpy и соответствие городов индексам в нём
+    """
+
+    def __init__(self, cities, matrix):
+        self.cities = list(cities)
+        self.index = {city: index for index, city in enumerate(self.cities)}
+        self.matrix = matrix
+
+    @classmethod
+    def from_graph(cls, graph):
+        """
+        Создание матрицы по графу функции create_graph,
+        в котором хранится только одна половина расстояний
+
+        :param graph: Матрица расстояний между городами либо DistanceMatrix
+        :return: Матрица расстояний DistanceMatrix
+        """
+        if isinstance(graph, cls):
+            return graph
+        cities = list(graph)
+        for i in graph.values():
+            cities.extend(j for j in i if j not in cities)
+        matrix = cls(cities, np.zeros((len(cities), len(cities))))
+        for i in graph:
+            for j, distance in graph[i].items():
+                matrix.matrix[matrix.index[i], matrix.index[j]] = distance
+                matrix.matrix[matrix.index[j], matrix.index[i]] = distance
+        return matrix
+
+    def __contains__(self, city):
+        return city in self.index
+
+    def distance(self, start_city, end_city):
+        """
+        :param start_city: Город, откуда выезжаем
+        :param end_city: Город, куда едем
+        :return: Расстояние между городами
+        """
+        return float(self.matrix[self.index[start_city],
+                                 self.index[end_city]])
+
+    def indices(self, course):
+        """
+        :param course: Маршрут либо список маршрутов из городов
+        :return: Массив индексов городов маршрута в матрице
+        """
+        return np.vectorize(self.index.__getitem__, otypes=[np.intp])(course)
+
+    def fingerprint(self, cities):
+        """
+        :param cities: Список городов
+        :return: Хеш городов с учётом повторов и расстояний между ними,
+                не зависящий от порядка городов
+        """
+        cities = sorted(cities)
+        digest = hashlib.sha1(json.dumps(cities).encode())
+        digest.update(np.ascontiguousarray(self.submatrix(cities),
+                                           dtype=float).tobytes())
+        return digest.hexdigest()
+
+    def submatrix(self, cities):
+        """
+        :param cities: Список городов
+        :return: Массив расстояний между переданными городами в их порядке
+        """
+        indices = self.indices(cities)
+        return self.matrix[np.ix_(indices, indices)]
+
+
+def get_distance(graph, start_city, end_city):
+    """
+    Функция, возвращающая расстояние между двумя городами
+    из матрицы графа функции create_graph либо из DistanceMatrix
+
+    :param graph: Матрица расстояний между городами
+    :param start_city: Город, откуда выезжаем
+    :param end_city: Город, куда едем
+    :return: Расстояние между городами
+    """
+    if isinstance(graph, DistanceMatrix):
+        return graph.distance(start_city, end_city)
+    if start_city in graph and end_city in graph[start_city]:
+        return graph[start_city][end_city]
+    return graph[end_city][start_city]
+
+
+async def create_graph(cities, cache=None, provider=None):
     """
     Функция, создающая матрицу для графа
      с вершинами в городах из переданного списка
 
     :param cities: Список городов, для которого создаётся граф
+    :param cache: Хранилище расстояний DistanceCache, может отсутствовать
+    :param provider: Источник расстояний DistanceProvider, по умолчанию
+            расстояния запрашиваются у внешнего сайта
     :return:
     """
     graph = dict()
     for i in cities[:len(cities) - 1]:
         graph[i] = {j: 0 for j in cities if i != j
                     and not (j in graph and i in graph[j])}
-    distances = await create_distances(graph)
+    distances = await create_distances(graph, cache, provider)
     for i in distances:
         graph[i[0]][i[1]] = i[2]
     return graph
 
 
-async def create_distances(graph):
+async def extend_graph(graph, cities, cache=None, provider=None):
+    """
+    Функция, дополняющая граф функции create_graph расстояниями
+    для новых городов: запрашиваются только отсутствующие в нём пары
+
+    :param graph: Матрица расстояний между городами прежнего графа
+    :param cities: Список городов, для которого нужен граф
+    :param cache: Хранилище расстояний DistanceCache, может отсутствовать
+    :param provider: Источник расстояний DistanceProvider, по умолчанию
+            расстояния запрашиваются у внешнего сайта
+    :return: Новая матрица расстояний, содержащая прежние расстояния.
+            Если расстояние для какой-то пары не получено, возникает
+            ValueError
+    """
+    missing = dict()
+    for index, i in enumerate(cities):
+        for j in cities[index + 1:]:
+            if i != j and not (i in graph and j in graph[i]) \
+                    and not (j in graph and i in graph[j]):
+                missing.setdefault(i, {})[j] = 0
+    graph = {i: dict(graph[i]) for i in graph}
+    for i in await create_distances(missing, cache, provider):
+        if i:
+            graph.setdefault(i[0], {})[i[1]] = i[2]
+    failed = [(i, j) for i in missing for j in missing[i]
+              if j not in graph.get(i, {})]
+    if failed:
+        raise ValueError('No road distance for {}'.format(failed))
+    return graph
+
+
+async def create_distances(graph, cache=None, provider=None):
     """
     Функция, возвращающая список расстояний между каждыми двумя городами из
-    переданного списка
+    переданного списка. Если передано хранилище, у источника
+    запрашиваются только отсутствующие в нём расстояния
 
     :param graph: Матрица городов, которую заполняем расстояниями
+    :param cache: Хранилище расстояний DistanceCache, может отсутствовать
+    :param provider: Источник расстояний DistanceProvider, по умолчанию
+            расстояния запрашиваются у внешнего сайта
     :return: Список конечных городов + расстояния до них
     """
-    distances = [asyncio.create_task(create_distance(i, j)) for i in graph
-                 for j in graph[i]]
+    pairs = [(i, j) for i in graph for j in graph[i]]
+    cached = cache.get_many(pairs) if cache else {}
+    fetch = provider.distance if provider else create_distance
+    distances = [asyncio.create_task(fetch(i, j)) for i, j in pairs
+                 if (i, j) not in cached]
     await asyncio.gather(*distances)
     distances = [j.result() for j in distances]
-    return distances
+    if cache:
+        cache.put_many([i for i in distances if i])
+    return [[i, j, distance] for (i, j), distance in cached.items()] \
+        + distances
 
 
-async def create_distance(start_city, end_city):
+async def create_distance(start_city, end_city, fetcher=None,
+                          base_url=None):
     """
     Функция запрашивающая у внешнего сайта расстояние между start_city, и end_city
 
     :param start_city: Город, откуда выезжаем
     :param end_city: Город, куда едем
+    :param fetcher: Общая сессия Fetcher, может отсутствовать
+    :param base_url: Начало адреса страницы расстояния, по умолчанию
+            distance url из конфигурации
     :return: Список:
             start_city, end_city, расстояние между городами
     """
-    url = 'https://www.travelmath.com/drive-distance/from/' + start_city + '/to/' + end_city
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            html = await response.text()
-    soup = BeautifulSoup(html, 'html.parser')
-    div = soup.find(id="drivedist")
-    if len(div) < 3:
+    url = (base_url or configs['distance url']) + start_city + '/to/' \
+        + end_city
+    html = await fetch_text(url, fetcher)
+    distance = parse_drive_distance(html)
+    if distance is None:
         return None
-    temp = str(div.contents[2].string)
-    if len(temp) == 9:
-        temp = temp[1:2] + temp[3:]
-    if len(temp) == 10:
-        temp = temp[1:3] + temp[4:]
-    if len(temp) == 11:
-        temp = temp[1:4] + temp[5:]
-    return [start_city, end_city, int(temp[:len(temp) - 2])]
+    return [start_city, end_city, distance]
@@ -3,26 +3,20 @@ import asyncio
 import csv
 import datetime
 import json
-import math
-
-import aiohttp
-from bs4 import BeautifulSoup
-
-from courses import create_courses, count_course
-from datetime_handle import create_datetime
-from graph import create_graph
-
-
-class Excursion:
-    """
-    Класс хранящий информацию об экскурсии
-    """
-
-    def __init__(self, name, city, start_time, duration):
-        self.name = name
-        self.city = city
-        self.start_time = start_time
-        self.duration = duration
+import os
+
+from cache import DistanceCache
+from courses import SOLVERS, TourCache, update_course
+from datetime_handle import (MINUTES_IN_HOUR, clock_to_datetime, next_day,
+                             time_of_day, to_minutes)
+from excursions import Excursion, get_excursion_slots, read_excursions
+from fetcher import Fetcher
+from graph import DistanceMatrix, create_graph, extend_graph, get_distance
+from profiling import profiler
+from providers import GazetteerProvider, ScrapingProvider
+from schedule import schedule_course
+from settings import configs
+from sparse import create_sparse_graph, resolve_course
 
 
 class City:
@@ -48,9 +42,84 @@ async def main():
     parser.add_argument("output_file")
     parser.add_argument("starting_city")
     parser.add_argument("--start_date", default=None)
+    parser.add_argument("--output_format", choices=["csv", "jsonl"],
+                        default="csv")
+    parser.add_argument("--echo", action="store_true")
+    parser.add_argument("--previous", default=None)
+    parser.add_argument("--sparse", type=int, default=None)
+    parser.add_argument("--coordinates", default=None)
+    add_planning_arguments(parser)
     args = parser.parse_args()
-    if args.start_date:
-        current_datetime = args.start_date.split(',')
+    if args.sparse and not (args.coordinates or args.gazetteer):
+        parser.error("--sparse requires --coordinates or --gazetteer")
+    if args.profile:
+        profiler.enable()
+    current_datetime, current_time = parse_start_date(args.start_date)
+    excursions = get_excursions(args.input_file)
+    cities = [i.city for i in excursions]
+    cities.append(args.starting_city)
+    cache = None
+    if args.distance_cache and not args.gazetteer:
+        cache = DistanceCache(args.distance_cache, configs['cache ttl'])
+    previous = read_state(args.previous)
+    estimated = set()
+    async with create_fetcher() as fetcher:
+        provider = create_provider(args.gazetteer, fetcher, cache)
+        with profiler.stage('create_graph'):
+            if previous:
+                graph = await extend_graph(previous['graph'], cities, cache,
+                                           provider)
+            elif args.sparse:
+                coordinates = GazetteerProvider(
+                    args.coordinates or args.gazetteer).coordinates
+                graph, estimated = await create_sparse_graph(
+                    cities, coordinates, args.sparse, cache, provider)
+            else:
+                graph = await create_graph(cities, cache, provider)
+        tours = TourCache(configs['tour cache size'], cache)
+        current_course = await resolve_course(
+            lambda matrix: choose_course(
+                excursions, args.starting_city,
+                DistanceMatrix.from_graph(matrix), current_time, args.solver,
+                tours, previous['course'] if previous else None),
+            graph, estimated, cache, provider)
+        if args.previous:
+            write_state(args.previous, current_course, graph, estimated)
+        await stream_course(plan_stops(excursions, args.starting_city,
+                                       DistanceMatrix.from_graph(graph),
+                                       current_datetime, current_time,
+                                       args.solver, provider, tours,
+                                       current_course),
+                            args.output_file, args.output_format, args.echo)
+    if cache:
+        cache.close()
+    if args.profile:
+        profiler.dump(args.profile)
+
+
+def add_planning_arguments(parser):
+    """
+    Функция, добавляющая общие для всех режимов запуска параметры расчёта
+
+    :param parser: Парсер параметров командной строки
+    """
+    parser.add_argument("--solver", choices=sorted(SOLVERS) + ["schedule"],
+                        default="brute_force")
+    parser.add_argument("--distance_cache", default=None)
+    parser.add_argument("--gazetteer", default=None)
+    parser.add_argument("--profile", default=None)
+
+
+def parse_start_date(start_date):
+    """
+    Функция, разбирающая дату и время отбытия из стартового города
+
+    :param start_date: Строка в формате год,месяц,день,часы:минуты,
+            либо None для текущего момента
+    :return: Дата в формате год, месяц, день и время в часах
+    """
+    if start_date:
+        current_datetime = start_date.split(',')
         current_time = current_datetime[3].split(':')
         current_time = int(current_time[0])+int(current_time[1])/60
         current_datetime = datetime.datetime(year=int(current_datetime[0]),
@@ -61,30 +130,146 @@ async def main():
         dt = datetime.datetime.now()
         current_datetime = datetime.datetime(dt.year, dt.month, dt.day)
         current_time = dt.hour+dt.minute/60+dt.second/3600
-    excursions = get_excursions(args.input_file)
+    return current_datetime, current_time
+
+
+def read_state(path):
+    """
+    :param path: Путь к файлу с маршрутом и графом прошлого запуска,
+            может отсутствовать
+    :return: Словарь с маршрутом course и матрицей расстояний graph,
+            либо None, если файла нет
+    """
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_state(path, current_course, graph, estimated=()):
+    """
+    :param path: Путь к файлу состояния для следующего запуска
+    :param current_course: Маршрут без промежуточных городов
+    :param graph: Матрица расстояний между городами функции create_graph
+    :param estimated: Пары городов, расстояния между которыми только
+            оценены, они не сохраняются
+    """
+    graph = {i: {j: distance for j, distance in graph[i].items()
+                 if (i, j) not in estimated} for i in graph}
+    with open(path, 'w') as f:
+        json.dump({'course': current_course, 'graph': graph}, f,
+                  ensure_ascii=False)
+
+
+def create_fetcher():
+    """
+    :return: Сессия Fetcher с ограничениями и повторами запросов
+            из конфигурации
+    """
+    return Fetcher(configs['requests per host'], configs['request timeout'],
+                   configs['retries'], configs['retry backoff'],
+                   configs['hedge requests'])
+
+
+def create_provider(gazetteer, fetcher, cache):
+    """
+    :param gazetteer: Путь к файлу координат городов, может отсутствовать
+    :param fetcher: Общая сессия Fetcher
+    :param cache: Хранилище DistanceCache, может отсутствовать
+    :return: Источник расстояний GazetteerProvider, если передан файл
+            координат, иначе ScrapingProvider
+    """
+    if gazetteer:
+        return GazetteerProvider(gazetteer, configs['road factor'],
+                                 configs['corridor width'])
+    return ScrapingProvider(fetcher, cache)
+
+
+async def plan_stops(excursions, starting_city, graph, current_datetime,
+                     current_time, solver="brute_force", provider=None,
+                     tours=None, current_course=None):
+    """
+    Асинхронный генератор, рассчитывающий оптимальный маршрут для переданных
+    экскурсий и выдающий города маршрута по мере их расстановки.
+    Как только порядок городов выбран, списки городов между соседними
+    городами, расстояние между которыми больше дневного пробега,
+    запрашиваются одновременно
+
+    :param excursions: Список экскурсий
+    :param starting_city: Стартовый город маршрута
+    :param graph: Матрица расстояний, содержащая все города экскурсий
+            и стартовый город
+    :param current_datetime: Дата отбытия в формате год, месяц, день
+    :param current_time: Время отбытия из стартового города в часах
+    :param solver: Название способа поиска оптимального маршрута
+    :param provider: Источник DistanceProvider, может отсутствовать
+    :param tours: Хранилище найденных маршрутов TourCache,
+            может отсутствовать
+    :param current_course: Уже выбранный порядок городов, по умолчанию
+            выбирается функцией choose_course
+    :return: Очередной город маршрута City
+    """
+    if not current_course:
+        current_course = choose_course(excursions, starting_city, graph,
+                                       current_time, solver, tours)
+    current_time = to_minutes(current_time)
+    (provider or default_provider).prefetch(
+        (i, j) for i, j in zip(current_course,
+                               current_course[1:] + current_course[:1])
+        if get_distance(graph, i, j)
+        > configs['velocity'] * configs['driving time'])
+    async for city in iterate_course(current_course, excursions, graph,
+                                     current_datetime, current_time,
+                                     starting_city, provider):
+        yield city
+
+
+def choose_course(excursions, starting_city, graph, current_time,
+                  solver="brute_force", tours=None, previous_course=None):
+    """
+    Функция, выбирающая порядок городов маршрута. Если передан маршрут
+    прошлого запуска с тем же стартовым городом, он перестраивается
+    под новый список городов функцией update_course вместо поиска заново
+
+    :param excursions: Список экскурсий
+    :param starting_city: Стартовый город маршрута
+    :param graph: Матрица расстояний DistanceMatrix
+    :param current_time: Время отбытия из стартового города в часах
+    :param solver: Название способа поиска оптимального маршрута
+    :param tours: Хранилище найденных маршрутов TourCache,
+            может отсутствовать
+    :param previous_course: Маршрут прошлого запуска, может отсутствовать
+    :return: Маршрут, начинающийся в стартовом городе
+    """
     cities = [i.city for i in excursions]
-    cities.append(args.starting_city)
-    graph = await create_graph(cities)
-    if len(cities) != 2:
-        all_courses = create_courses(cities[:len(cities) - 1])
-        min_distance = math.inf
-        for i in all_courses:
-            i.insert(0, args.starting_city)
-            distance = count_course(i, graph)
-            if distance < min_distance:
-                current_course = i
-                min_distance = distance
-    else:
-        current_course = [cities[1], cities[0]]
-    current_course, current_parameters \
-        = await create_course_with_middle_cities(current_course, excursions,
-                                                 graph, current_datetime,
-                                                 current_time)
-    current_course = \
-        await complete_course(current_course, current_parameters[0],
-                              current_parameters[1], args.starting_city, graph,
-                              current_parameters[2])
-    write_course(current_course, args.output_file)
+    with profiler.stage('solver'):
+        if len(cities) == 1:
+            return [starting_city, cities[0]]
+        if solver == "schedule":
+            return schedule_course(cities, starting_city, graph, excursions,
+                                   to_minutes(current_time), configs)
+        if previous_course and previous_course[0] == starting_city:
+            return update_course(previous_course, cities, starting_city,
+                                 graph)
+        if tours:
+            return tours.course(solver, cities, starting_city, graph)
+        return SOLVERS[solver](cities, starting_city, graph)
+
+
+async def plan_course(excursions, starting_city, graph, current_datetime,
+                      current_time, solver="brute_force", provider=None,
+                      tours=None, current_course=None):
+    """
+    Функция, рассчитывающая оптимальный маршрут для переданных экскурсий
+    с промежуточными городами и возвращением в стартовый город.
+    Параметры те же, что у plan_stops
+
+    :return: Завершённый маршрут движения
+    """
+    return [i async for i in plan_stops(excursions, starting_city, graph,
+                                        current_datetime, current_time,
+                                        solver, provider, tours,
+                                        current_course)]
 
 
 def get_excursions(input_file):
@@ -92,235 +277,291 @@ def get_excursions(input_file):
     Функция, возвращающая спискок экскурсий из переданного файла
 
     :param input_file: Путь к файлу, содержащему список экскурсий
-    :return: Список экскурсий
+    :return: Список экскурсий с разобранными временами начала
+            ExcursionCatalogue
     """
-    excursions = []
-    with open(input_file) as csvfile:
-        reader = csv.DictReader(csvfile)
-        for i in reader:
-            excursions.append(Excursion(i['Name'], i['City'],
-                                        i['Start time'], i['Duration']))
-    return excursions
+    return read_excursions(input_file)
 
 
 async def create_course_with_middle_cities(current_course, excursions, graph,
-                                           current_datetime, current_time):
+                                           current_time, provider=None):
     """
     Функция, заполняющая переданный маршрут промежуточными городами
 
-    :param current_time: Время отбытия из стартового города
-    :param current_datetime: Текущая дата в формате год, месяц, день
+    :param provider: Источник DistanceProvider, может отсутствовать
+    :param current_time: Время отбытия из стартового города в минутах
+            от полуночи первого дня поездки
     :param graph: Матрица расстояний между городами
     :param current_course: Изначальный маршрут поездки
     :param excursions: Список экскурсий в изначальных городах
     :return: Маршрут поездки с промежуточными городами, кроме возвращения
-            в стартовый город
+            в стартовый город, и список из времени за рулем в текущий день
+            и времени отбытия из последнего города
+    """
+    stops = []
+    parameters = [0, current_time]
+    async for city, current_parameters in \
+            iterate_middle_cities(current_course, excursions, graph,
+                                  current_time, provider):
+        stops.append(city)
+        parameters = current_parameters or parameters
+    return stops, parameters
+
+
+async def iterate_middle_cities(current_course, excursions, graph,
+                                current_time, provider=None):
+    """
+    Асинхронный генератор, выдающий города переданного маршрута вместе
+    с промежуточными городами по одному. Время отбытия уже выданного
+    города может измениться при расстановке следующего
+
+    :param current_course: Изначальный маршрут поездки
+    :param excursions: Список экскурсий в изначальных городах
+    :param graph: Матрица расстояний между городами
+    :param current_time: Время отбытия из стартового города в минутах
+            от полуночи первого дня поездки
+    :param provider: Источник DistanceProvider, может отсутствовать
+    :return: Очередной город City и список из времени за рулем
+            в текущий день и времени отбытия из него, для стартового
+            города None
     """
     current_drive_time = 0
-    current_course[0] = City(current_course[0], None,
-                             create_datetime(current_datetime, current_time),
-                             "starting point")
+    previous = City(current_course[0], None, current_time, "starting point")
+    yield previous, None
     distance = None
-    for index, i in enumerate(current_course):
-        if index == len(current_course) - 1:
-            break
-
-        possible_middle_city \
-            = await \
-            put_middle_city(i.name, current_course[index + 1],
-                            current_drive_time, current_time,
-                            distance, current_datetime, graph, excursions)
+    index = 1
+    while index < len(current_course):
+        with profiler.stage('put_middle_city'):
+            possible_middle_city \
+                = await \
+                put_middle_city(previous.name, current_course[index],
+                                current_drive_time, current_time,
+                                distance, graph, excursions,
+                                provider=provider)
+        if len(possible_middle_city) == 3:
+            previous.leaving = next_day(current_time,
+                                        to_minutes(configs['start']))
         current_drive_time = possible_middle_city[1][0]
-        current_datetime = possible_middle_city[1][1]
-        current_time = possible_middle_city[1][2]
+        current_time = possible_middle_city[1][1]
         distance = None
-        if possible_middle_city[0].name == current_course[index + 1]:
-            current_course[index + 1] = possible_middle_city[0]
+        if possible_middle_city[0].name == current_course[index]:
+            index += 1
         else:
-            current_course.insert(index + 1, possible_middle_city[0])
-            distance = possible_middle_city[1][3]
-        if len(possible_middle_city) == 3:
-            current_course[index].leaving =\
-                create_datetime(current_datetime, 8)
-    return current_course, [current_drive_time, current_time, current_datetime]
+            distance = possible_middle_city[1][2]
+        previous = possible_middle_city[0]
+        yield previous, [current_drive_time, current_time]
+
+
+async def iterate_course(current_course, excursions, graph, current_datetime,
+                         current_time, start_city, provider=None):
+    """
+    Асинхронный генератор, выдающий все города маршрута по мере
+    их расстановки, включая возвращение в стартовый город. Город выдаётся,
+    когда расставлен следующий, так как тот может изменить время отбытия.
+    Время приезда и отбытия переводится в дату только при выдаче города
+
+    :param current_course: Изначальный маршрут поездки
+    :param excursions: Список экскурсий в изначальных городах
+    :param graph: Матрица расстояний между городами
+    :param current_datetime: Дата начала поездки в формате год, месяц, день
+    :param current_time: Время отбытия из стартового города в минутах
+            от полуночи первого дня поездки
+    :param start_city: Стартовый город
+    :param provider: Источник DistanceProvider, может отсутствовать
+    :return: Очередной город маршрута City
+    """
+    previous = None
+    parameters = [0, current_time]
+    async for city, current_parameters in \
+            iterate_middle_cities(current_course, excursions, graph,
+                                  current_time, provider):
+        if previous:
+            yield create_output_city(previous, current_datetime)
+        previous = city
+        parameters = current_parameters or parameters
+    async for city in iterate_completion(previous, parameters[0],
+                                         parameters[1], start_city, graph,
+                                         provider):
+        yield create_output_city(previous, current_datetime)
+        previous = city
+    yield create_output_city(previous, current_datetime)
+
+
+def create_output_city(city, current_datetime):
+    """
+    :param city: Город маршрута City со временем в минутах
+    :param current_datetime: Дата начала поездки в формате год, месяц, день
+    :return: Город City с датой и временем приезда и отбытия
+    """
+    return City(city.name, clock_to_datetime(current_datetime, city.arrival),
+                clock_to_datetime(current_datetime, city.leaving),
+                city.stop_name)
 
 
 async def put_middle_city(start_city, end_city, current_drive_time,
-                          current_time, distance, current_datetime, graph=None,
-                          excursions=None, starting_city=None):
+                          current_time, distance, graph=None,
+                          excursions=None, starting_city=None, provider=None):
     """
     Асинхронная функция, возвращающая данные либо о промежуточном городе,
     либо о городе с экскурсией через функцию create_excursion_city.
     Если вызванна из функции complete_course возвращает данные
-    либо о промежуточном городе, либо о времени приезда в стартовый город
+    либо о промежуточном городе, либо о времени приезда в стартовый город.
+    Время считается в минутах от полуночи первого дня поездки
 
-    :param current_datetime: Текущая дата в формате год, месяц, день
     :param graph: Матрица расстояний между городами
     :param start_city: Город, откуда выезжаем
     :param end_city: Город, куда пытаемся приехать
-    :param current_drive_time: Время за рулем в текущий день
+    :param current_drive_time: Время за рулем в текущий день в минутах
     :param current_time: Время отбытия из города, откуда выезжаем
     :param distance: Расстояние между городами, может отсутствовать
     :param excursions: Список экскурсий, может отстутствовать
     :param starting_city: Параметр из функции complete_course,
             стартовый город маршрута
+    :param provider: Источник DistanceProvider, может отсутствовать
     :return: Данные о городе с экскурсией функции create_excursion_city, либо
             данные о промежуточном городе в виде списка:
             Название, время прибытия, время отбытия, название экскурсии в городе
             и обновлённое время за рулем в текущий день
             либо если вызванна из функции complete_course и достигнут стартовый
-            город маршрута, данные о времени достижения этого города
+            город маршрута, данные о времени достижения этого города.
+            Если выезд перенесён на следующий день, в конец списка
+            добавляется True
     """
     if not distance:
-        if start_city in graph and end_city in graph[start_city]:
-            distance = graph[start_city][end_city]
-        elif end_city in graph and start_city in graph[end_city]:
-            distance = graph[end_city][start_city]
+        distance = get_distance(graph, start_city, end_city)
     max_driving_distance = min(
-        configs['driving time'] - current_drive_time,
-        configs['end'] - current_time
-    ) * configs["velocity"]
+        to_minutes(configs['driving time']) - current_drive_time,
+        to_minutes(configs['end']) - time_of_day(current_time)
+    ) * configs["velocity"] / MINUTES_IN_HOUR
 
     if distance < max_driving_distance:
         if end_city == starting_city:
-            arrival_datetime = create_datetime(current_datetime,
-                                               current_time + distance
-                                               / configs["velocity"])
-            return City(end_city, arrival_datetime, None,
+            return City(end_city, current_time
+                        + to_minutes(distance / configs["velocity"]), None,
                         "Ending point"), None
         return create_excursion_city(end_city, excursions, current_time,
-                                     distance, current_drive_time,
-                                     current_datetime)
+                                     distance, current_drive_time)
     middle_city = await find_middle_city(start_city, end_city,
-                                         max_driving_distance)
+                                         max_driving_distance, provider)
     current_drive_time = 0
     if middle_city:
         if distance - middle_city[1] > \
                 configs['driving time'] * configs["velocity"]:
             second_city = await find_middle_city(middle_city[0], end_city,
                                                  configs['driving time']
-                                                 * configs["velocity"])
+                                                 * configs["velocity"],
+                                                 provider)
             if second_city:
                 return create_middle_city(middle_city[0], distance,
                                           middle_city[1],
-                                          current_time, current_datetime,
-                                          current_drive_time)
+                                          current_time, current_drive_time)
         else:
             return create_middle_city(middle_city[0], distance, middle_city[1],
-                                      current_time, current_datetime,
-                                      current_drive_time)
-    current_datetime = current_datetime + datetime.timedelta(days=1)
+                                      current_time, current_drive_time)
+    current_time = next_day(current_time, to_minutes(configs['start']))
     max_driving_distance = configs['driving time'] * configs["velocity"]
-    if distance < max_driving_distance:
-        current_time = 8
+    middle_city = None
+    if distance >= max_driving_distance:
+        middle_city = await find_middle_city(start_city, end_city,
+                                             max_driving_distance, provider) \
+            or await find_nearest_city(start_city, end_city, provider)
+    if not middle_city:
         if end_city == starting_city:
-            arrival_datetime = create_datetime(current_datetime,
-                                               current_time + distance
-                                               / configs["velocity"])
-            return [City(end_city, arrival_datetime, None,
+            return [City(end_city, current_time
+                         + to_minutes(distance / configs["velocity"]), None,
                          "Ending point"), None, True]
         create_excursion_city_dec = decorator(create_excursion_city)
         return create_excursion_city_dec(end_city, excursions, current_time,
-                                         distance, current_drive_time,
-                                         current_datetime)
-    middle_city = await find_middle_city(start_city, end_city,
-                                         max_driving_distance)
+                                         distance, current_drive_time)
     create_middle_city_dec = decorator(create_middle_city)
     return create_middle_city_dec(middle_city[0], distance, middle_city[1],
-                                  current_time, current_datetime,
-                                  current_drive_time)
+                                  current_time, current_drive_time)
 
 
 def create_excursion_city(excursion_city, excursions, current_time,
-                          distance, current_drive_time, current_datetime):
+                          distance, current_drive_time):
     """
     Функция генерирует данные о городе с экскурсией на основе входных параметров
 
-    :param current_datetime: Текущая дата в формате год, месяц, день
     :param excursion_city: Город в котором проходит экскурсия
     :param excursions: Список всех экскурсий
-    :param current_time: Время отбытия из предудущего города
+    :param current_time: Время отбытия из предудущего города в минутах
+            от полуночи первого дня поездки
     :param distance: Расстояние между предудущим городом и текущим
-    :param current_drive_time: Время за рулем в текущий день
+    :param current_drive_time: Время за рулем в текущий день в минутах
     :return: Список хранящий данные о посещенном городе:
         Название, время прибытия, время отбытия, название экскурсии в городе
         и обновлённое время за рулем в текущий день
     """
-    excursion = [i for i in excursions if i.city == excursion_city]
-    arrival = current_time + distance / configs["velocity"]
-    times = excursion[0].start_time.strip().split(',')
-    for index2, time in enumerate(times):
-        time = time.split(':')
-        time = int(time[0]) + int(time[1]) / 60
-        times[index2] = time
-    for time in times:
-        if time > arrival:
-            excursion_start_time = time
-            new_current_drive_time = \
-                current_drive_time + distance / configs["velocity"]
-            new_current_datetime = current_datetime
-            break
-        excursion_start_time = times[0]
+    excursion = get_excursion_slots(excursions, excursion_city)
+    travel_time = to_minutes(distance / configs["velocity"])
+    arrival = current_time + travel_time
+    excursion_start_time, following_day = \
+        excursion.next_start(time_of_day(arrival))
+    if following_day:
         new_current_drive_time = 0
-        new_current_datetime = current_datetime + datetime.timedelta(days=1)
-    duration = excursion[0].duration
-    current_time = excursion_start_time + int(duration[:len(duration) - 1])
-    stop_name = excursion[0].name
-    arrival_datetime = create_datetime(current_datetime, arrival)
-    leaving_datetime = create_datetime(current_datetime, current_time)
-    return [City(excursion_city, arrival_datetime, leaving_datetime,
-                stop_name), [new_current_drive_time,
-                             new_current_datetime, current_time]]
+        current_time = next_day(arrival, excursion_start_time)
+    else:
+        new_current_drive_time = current_drive_time + travel_time
+        current_time = arrival - time_of_day(arrival) + excursion_start_time
+    current_time += excursion.duration
+    return [City(excursion_city, arrival, current_time, excursion.name),
+            [new_current_drive_time, current_time]]
 
 
 def create_middle_city(city_name, distance, travel_distance, current_time,
-                       current_datetime, current_drive_time):
+                       current_drive_time):
     """
     Функция генерирует данные о городе с экскурсией на основе входных параметров
 
-    :param current_datetime: Текущая дата в формате год, месяц, день
     :param city_name: Название промежуточного города
     :param travel_distance: Расстояние до промежуточного города
-    :param current_time: Время отбытия из предудущего города
+    :param current_time: Время отбытия из предудущего города в минутах
+            от полуночи первого дня поездки
     :param distance: Расстояние между предудущим городом и текущим
-    :param current_drive_time: Время за рулем в текущий день
+    :param current_drive_time: Время за рулем в текущий день в минутах
     :return: Список хранящий данные о посещенном городе:
         Название, время прибытия, время отбытия, название экскурсии в городе
         и обновлённое время за рулем в текущий день
     """
-    arrival = current_time + travel_distance / configs["velocity"]
-    current_time = 8
-    arrival_datetime = create_datetime(current_datetime, arrival)
-    current_datetime = current_datetime + datetime.timedelta(days=1)
-    leaving_datetime = create_datetime(current_datetime, current_time)
-    return [City(city_name, arrival_datetime, leaving_datetime,
-                 "Stopping point"), [current_drive_time, current_datetime,
-                                     current_time, distance - travel_distance]]
+    arrival = current_time + to_minutes(travel_distance / configs["velocity"])
+    current_time = next_day(arrival, to_minutes(configs['start']))
+    return [City(city_name, arrival, current_time, "Stopping point"),
+            [current_drive_time, current_time, distance - travel_distance]]
 
 
-async def find_middle_city(start_city, end_city, max_driving_distance):
+async def find_middle_city(start_city, end_city, max_driving_distance,
+                           provider=None):
     """
-    Функция, запрашивающая у внешнего сайта список всех городов между
-    start_city и end_city и самый дальний,
-    расстояние до которого не превосходит max_driving_distance
+    Функция, находящая среди всех городов между start_city и end_city
+    самый дальний, расстояние до которого не превосходит max_driving_distance
 
     :param start_city: Город, откуда выезжаем
     :param end_city: Город, куда едем
     :param max_driving_distance: Максимальная дальность поездки в текущий день
-    :return:
+    :param provider: Источник DistanceProvider, по умолчанию
+            списки городов запрашиваются у внешнего сайта
+    :return: Название города и расстояние до него, либо None
     """
-    url = 'https://citiesbetween.com/' + start_city + '-and-' + end_city
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            html = await response.text()
-    soup = BeautifulSoup(html, 'html.parser')
-    div = soup.find_all(class_="cityinfo")
-    for index, i in enumerate(div):
-        distance = i.contents[2].contents[0]
-        if int(distance[:len(distance) - 3]) > max_driving_distance:
-            distance = div[index - 1].contents[2].contents[0]
-            return [str(div[index - 1].contents[0].string),
-                    int(distance[:len(distance) - 3])]
+    corridor = await (provider or default_provider).corridor(start_city,
+                                                             end_city)
+    return corridor.furthest(max_driving_distance)
+
+
+async def find_nearest_city(start_city, end_city, provider=None):
+    """
+    Функция, находящая ближайший город между start_city и end_city,
+    в котором можно остановиться, если за день не доехать ни до одного
+
+    :param start_city: Город, откуда выезжаем
+    :param end_city: Город, куда едем
+    :param provider: Источник DistanceProvider, по умолчанию
+            списки городов запрашиваются у внешнего сайта
+    :return: Название города и расстояние до него, либо None
+    """
+    corridor = await (provider or default_provider).corridor(start_city,
+                                                             end_city)
+    return corridor.nearest()
 
 
 def decorator(func):
@@ -338,63 +579,143 @@ def decorator(func):
 
 
 async def complete_course(current_course, current_drive_time,
-                          current_time, start_city, graph, current_datetime):
+                          current_time, start_city, graph, provider=None):
     """
     Функция, завершающая маршрут, добавляя промежуточные города
     между стартовым городом и последним городом в маршруте
 
-    :param current_datetime: Текущая дата в формате год, месяц, день
+    :param provider: Источник DistanceProvider, может отсутствовать
     :param graph: Матрица расстояний между городами
     :param current_course: Маршрут движения
-    :param current_drive_time: Время за рулем в текущий день
-    :param current_time: Время отбытия из города, откуда выезжаем
+    :param current_drive_time: Время за рулем в текущий день в минутах
+    :param current_time: Время отбытия из города, откуда выезжаем, в минутах
+            от полуночи первого дня поездки
     :param start_city: Стартовы1 город
     :return: Завершённый маршрут движения
     """
-    end_city = current_course[len(current_course) - 1].name
-    if start_city in graph and end_city in graph[start_city]:
-        distance = graph[start_city][end_city]
-    else:
-        distance = graph[end_city][start_city]
+    async for city in iterate_completion(
+            current_course[len(current_course) - 1], current_drive_time,
+            current_time, start_city, graph, provider):
+        current_course.append(city)
+    return current_course
+
+
+async def iterate_completion(previous, current_drive_time, current_time,
+                             start_city, graph, provider=None):
+    """
+    Асинхронный генератор, выдающий промежуточные города между последним
+    городом маршрута и стартовым городом, а затем сам стартовый город.
+    Время отбытия предыдущего города может измениться при расстановке
+    следующего
+
+    :param previous: Последний город маршрута City
+    :param current_drive_time: Время за рулем в текущий день в минутах
+    :param current_time: Время отбытия из последнего города в минутах
+            от полуночи первого дня поездки
+    :param start_city: Стартовый город
+    :param graph: Матрица расстояний между городами
+    :param provider: Источник DistanceProvider, может отсутствовать
+    :return: Очередной город City
+    """
+    end_city = previous.name
+    distance = get_distance(graph, start_city, end_city)
     while True:
-        city = \
-            await put_middle_city(end_city, start_city, current_drive_time,
-                                  current_time, distance, current_datetime,
-                                  graph, starting_city=start_city)
+        with profiler.stage('put_middle_city'):
+            city = \
+                await put_middle_city(end_city, start_city,
+                                      current_drive_time, current_time,
+                                      distance, graph,
+                                      starting_city=start_city,
+                                      provider=provider)
         end_city = city[0].name
-        current_course.append(city[0])
         if len(city) == 3:
-            current_course[len(current_course)-2].leaving =\
-                create_datetime(current_datetime +
-                                datetime.timedelta(days=1), 8)
-        if end_city != start_city:
-            current_drive_time = city[1][0]
-            current_datetime = city[1][1]
-            current_time = city[1][2]
-            distance = city[1][3]
-        else:
+            previous.leaving = next_day(current_time,
+                                        to_minutes(configs['start']))
+        previous = city[0]
+        yield previous
+        if end_city == start_city:
             break
-    return current_course
+        current_drive_time = city[1][0]
+        current_time = city[1][1]
+        distance = city[1][2]
 
 
-def write_course(current_course, output_file):
+def write_course(current_course, output_file, output_format="csv",
+                 echo=False):
     """
     Функция, записывающая переданный маршрут в переданный файл
 
     :param current_course: Завершеный маршрут движения
     :param output_file: Путь к файлу для записи
+    :param output_format: Формат файла: csv либо jsonl
+    :param echo: Выводить ли города маршрута в консоль
     """
+    with open(output_file, 'w') as output, profiler.stage('write_course'):
+        write_city = create_city_writer(output, output_format, echo)
+        for i in current_course:
+            write_city(i)
+
+
+async def stream_course(stops, output_file, output_format="csv", echo=False):
+    """
+    Функция, записывающая города маршрута в переданный файл по мере
+    их расстановки, сразу сбрасывая каждую строку на диск
+
+    :param stops: Асинхронный генератор городов маршрута City
+    :param output_file: Путь к файлу для записи
+    :param output_format: Формат файла: csv либо jsonl
+    :param echo: Выводить ли города маршрута в консоль
+    :return: Количество записанных городов
+    """
+    count = 0
     with open(output_file, 'w') as output:
+        write_city = create_city_writer(output, output_format, echo)
+        async for i in stops:
+            with profiler.stage('write_course'):
+                write_city(i)
+                output.flush()
+            count += 1
+    return count
+
+
+def create_city_writer(output, output_format="csv", echo=False):
+    """
+    Функция, создающая функцию записи одного города маршрута в файл.
+    Для формата csv сразу записывается заголовок
+
+    :param output: Открытый файл для записи
+    :param output_format: Формат файла: csv либо jsonl
+    :param echo: Выводить ли города маршрута в консоль
+    :return: Функция, принимающая город City
+    """
+    if output_format == "csv":
         writer = csv.writer(output)
-        writer.writerow(['Название города', 'Время приезда',
-                        'Время убытия', 'Экскурсия/остановка'])
-        for i in current_course:
-            print(i.name, i.arrival, i.leaving, i.stop_name)
-            writer.writerow([i.name, i.arrival, i.leaving, i.stop_name])
+        writer.writerow(COLUMNS)
+        write_row = writer.writerow
+    else:
+        def write_row(row):
+            output.write(json.dumps(create_record(row),
+                                    ensure_ascii=False) + '\n')
+
+    def write_city(city):
+        if echo:
+            print(city.name, city.arrival, city.leaving, city.stop_name)
+        write_row([city.name, city.arrival, city.leaving, city.stop_name])
+    return write_city
+
+
+def create_record(row):
+    """
+    :param row: Название города, время приезда, время убытия
+            и название экскурсии либо остановки
+    :return: Словарь с названиями колонок COLUMNS и строковыми значениями
+    """
+    return dict(zip(COLUMNS, [None if i is None else str(i) for i in row]))
 
 
-with open('config.json') as f:
-    configs = json.load(f)
+COLUMNS = ['Название города', 'Время приезда', 'Время убытия',
+           'Экскурсия/остановка']
+default_provider = ScrapingProvider()
 if __name__ == "__main__":
     loop = asyncio.get_event_loop()
     loop.run_until_complete(main())
@@ -0,0 +1,80 @@
+import re
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+
+def parse_drive_distance(html):
+    """
+    Функция, извлекающая расстояние по дорогам со страницы travelmath.com.
+    Вместо разбора всей страницы регулярным выражением вырезается только
+    элемент #drivedist, и разбирается только он
+
+    :param html: Текст страницы
+    :return: Расстояние в километрах, либо None, если его нет на странице
+    """
+    match = DRIVE_DISTANCE_START.search(html)
+    if not match:
+        return None
+    end = find_element_end(html, match.start(), match.group(1))
+    div = BeautifulSoup(html[match.start():end],
+                        'html.parser').find(id="drivedist")
+    if len(div) < 3:
+        return None
+    temp = str(div.contents[2].string)
+    if len(temp) == 9:
+        temp = temp[1:2] + temp[3:]
+    if len(temp) == 10:
+        temp = temp[1:3] + temp[4:]
+    if len(temp) == 11:
+        temp = temp[1:4] + temp[5:]
+    return int(temp[:len(temp) - 2])
+
+
+def parse_corridor(html):
+    """
+    Функция, извлекающая города между двумя городами со страницы
+    citiesbetween.com. Разбирается только часть страницы от первого
+    до конца последнего элемента .cityinfo, и дерево строится
+    только из элементов .cityinfo
+
+    :param html: Текст страницы
+    :return: Список из расстояний до городов и их названий
+    """
+    starts = list(CITY_INFO_START.finditer(html))
+    if not starts:
+        return []
+    end = find_element_end(html, starts[-1].start(), starts[-1].group(1))
+    soup = BeautifulSoup(html[starts[0].start():end], 'html.parser',
+                         parse_only=CITY_INFO)
+    cities = []
+    for i in soup.find_all(class_="cityinfo"):
+        distance = i.contents[2].contents[0]
+        cities.append((int(distance[:len(distance) - 3]),
+                       str(i.contents[0].string)))
+    return cities
+
+
+def find_element_end(html, start, tag):
+    """
+    Функция, находящая конец элемента с учётом вложенных элементов
+    с тем же тегом
+
+    :param html: Текст страницы
+    :param start: Позиция открывающего тега элемента
+    :param tag: Тег элемента
+    :return: Позиция после закрывающего тега, либо конец страницы
+    """
+    depth = 0
+    pattern = re.compile(r'<(/?)' + tag + r'\b[^>]*>', re.I)
+    for match in pattern.finditer(html, start):
+        depth += -1 if match.group(1) else 1
+        if not depth:
+            return match.end()
+    return len(html)
+
+
+DRIVE_DISTANCE_START = re.compile(
+    r'<(\w+)[^>]*\bid=["\']drivedist["\'][^>]*>')
+CITY_INFO_START = re.compile(
+    r'<(\w+)[^>]*\bclass=["\'][^"\']*\bcityinfo\b[^"\']*["\'][^>]*>')
+CITY_INFO = SoupStrainer(class_="cityinfo")
@@ -0,0 +1,96 @@
+import contextlib
+import json
+import time
+
+
+class Profiler:
+    """
+    Класс собирающий время этапов расчёта, количество и время запросов
+    к каждому сайту и счётчики событий. Пока сбор не включён,
+    все функции сразу возвращаются, ничего не замеряя
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        self.counters = {}
+        self.hosts = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def stage(self, name):
+        """
+        Функция, возвращающая контекстный менеджер, добавляющий
+        время выполнения блока к времени этапа
+
+        :param name: Название этапа
+        :return: Контекстный менеджер
+        """
+        if not self.enabled:
+            return NULL_STAGE
+        return self._measure_stage(name)
+
+    @contextlib.contextmanager
+    def _measure_stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, [0, 0.0])
+            stage[0] += 1
+            stage[1] += time.perf_counter() - start
+
+    def count(self, name, amount=1):
+        """
+        :param name: Название счётчика
+        :param amount: Величина, на которую увеличивается счётчик
+        """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def request(self, host, seconds):
+        """
+        :param host: Сайт, к которому был запрос
+        :param seconds: Время запроса в секундах
+        """
+        if self.enabled:
+            requests = self.hosts.setdefault(host, [])
+            requests.append(seconds)
+
+    def report(self):
+        """
+        :return: Словарь с временем этапов, запросами к каждому сайту,
+                счётчиками и количеством маршрутов, оценённых за секунду
+        """
+        report = {
+            'stages': {name: {'calls': calls, 'seconds': seconds}
+                       for name, (calls, seconds) in self.stages.items()},
+            'http': {},
+            'counters': dict(self.counters),
+        }
+        for host, requests in self.hosts.items():
+            requests = sorted(requests)
+            report['http'][host] = {
+                'requests': len(requests),
+                'seconds': sum(requests),
+                'mean': sum(requests) / len(requests),
+                'max': requests[-1],
+                'p95': requests[int(0.95 * (len(requests) - 1))],
+            }
+        solver = self.stages.get('solver')
+        if 'permutations' in self.counters and solver and solver[1]:
+            report['permutations per second'] = \
+                self.counters['permutations'] / solver[1]
+        return report
+
+    def dump(self, path):
+        """
+        :param path: Путь к файлу отчёта в формате JSON
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+
+
+NULL_STAGE = contextlib.nullcontext()
+profiler = Profiler()
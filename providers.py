@@ -0,0 +1,243 @@
+import abc
+import asyncio
+import bisect
+import collections
+import csv
+import math
+
+from fetcher import fetch_text
+from graph import create_distance
+from parsing import parse_corridor
+from settings import configs
+
+
+class Corridor:
+    """
+    Класс хранящий города между двумя городами,
+    отсортированные по расстоянию от города, откуда выезжаем
+    """
+
+    def __init__(self, names, distances):
+        self.names = names
+        self.distances = distances
+
+    def furthest(self, max_driving_distance):
+        """
+        Функция, находящая бинарным поиском самый дальний город,
+        расстояние до которого не превосходит max_driving_distance
+
+        :param max_driving_distance: Максимальная дальность поездки
+        :return: Название города и расстояние до него, либо None, если
+                таких городов нет
+        """
+        index = bisect.bisect_right(self.distances, max_driving_distance)
+        if index == 0:
+            return None
+        return [self.names[index - 1], self.distances[index - 1]]
+
+    def nearest(self):
+        """
+        :return: Название ближайшего города и расстояние до него, либо None,
+                если между городами нет городов
+        """
+        if not self.names:
+            return None
+        return [self.names[0], self.distances[0]]
+
+
+class DistanceProvider(abc.ABC):
+    """
+    Базовый класс источника расстояний между городами и списков городов
+    между двумя городами. Задачи получения списков городов хранятся
+    в памяти, поэтому для каждой пары городов список создаётся один раз,
+    даже если его одновременно ждут несколько вызовов. Если задан size,
+    хранятся только size последних использованных задач
+    """
+
+    def __init__(self):
+        self.corridors = collections.OrderedDict()
+        self.size = None
+
+    @abc.abstractmethod
+    async def distance(self, start_city, end_city):
+        """
+        :param start_city: Город, откуда выезжаем
+        :param end_city: Город, куда едем
+        :return: Список:
+                start_city, end_city, расстояние между городами
+        """
+
+    async def corridor(self, start_city, end_city):
+        """
+        :param start_city: Город, откуда выезжаем
+        :param end_city: Город, куда едем
+        :return: Города между start_city и end_city Corridor
+        """
+        key = (start_city, end_city)
+        self.prefetch([key])
+        try:
+            return await asyncio.shield(self.corridors[key])
+        except Exception:
+            self.corridors.pop(key, None)
+            raise
+
+    def prefetch(self, pairs):
+        """
+        Функция, запускающая получение списков городов для всех переданных
+        пар городов одновременно, не дожидаясь результатов.
+        Последующие вызовы corridor получат уже запущенные задачи,
+        ошибка задачи, которую так и не запросили, не выводится
+
+        :param pairs: Пары городов, откуда и куда едем
+        """
+        for start_city, end_city in pairs:
+            key = (start_city, end_city)
+            if key not in self.corridors:
+                self.corridors[key] = asyncio.ensure_future(
+                    self.create_corridor(start_city, end_city))
+                self.corridors[key].add_done_callback(retrieve_exception)
+            self.corridors.move_to_end(key)
+            if self.size and len(self.corridors) > self.size:
+                self.corridors.popitem(last=False)
+
+    @abc.abstractmethod
+    async def create_corridor(self, start_city, end_city):
+        """
+        :param start_city: Город, откуда выезжаем
+        :param end_city: Город, куда едем
+        :return: Города между start_city и end_city Corridor
+        """
+
+
+class ScrapingProvider(DistanceProvider):
+    """
+    Класс источника, запрашивающего расстояния у travelmath.com,
+    а списки городов между двумя городами у citiesbetween.com
+    """
+
+    def __init__(self, fetcher=None, cache=None, distance_url=None,
+                 corridor_url=None):
+        """
+        :param fetcher: Общая сессия Fetcher, может отсутствовать
+        :param cache: Хранилище DistanceCache для списков городов,
+                может отсутствовать
+        :param distance_url: Начало адреса страницы расстояния,
+                по умолчанию distance url из конфигурации
+        :param corridor_url: Начало адреса страницы городов между
+                двумя городами, по умолчанию corridor url из конфигурации
+        """
+        super().__init__()
+        self.fetcher = fetcher
+        self.cache = cache
+        self.distance_url = distance_url or configs['distance url']
+        self.corridor_url = corridor_url or configs['corridor url']
+
+    async def distance(self, start_city, end_city):
+        return await create_distance(start_city, end_city, self.fetcher,
+                                     self.distance_url)
+
+    async def create_corridor(self, start_city, end_city):
+        stored = self.cache.get_corridor(start_city, end_city) \
+            if self.cache else None
+        if stored:
+            return Corridor(*stored)
+        url = self.corridor_url + start_city + '-and-' + end_city
+        cities = parse_corridor(await fetch_text(url, self.fetcher))
+        cities.sort(key=lambda city: city[0])
+        names = [i[1] for i in cities]
+        distances = [i[0] for i in cities]
+        if self.cache:
+            self.cache.put_corridor(start_city, end_city, names, distances)
+        return Corridor(names, distances)
+
+
+class GazetteerProvider(DistanceProvider):
+    """
+    Класс источника, работающего без сети по файлу координат городов:
+    расстояние по дорогам оценивается как расстояние по большому кругу,
+    умноженное на коэффициент, а городами между двумя городами считаются
+    города, проекция которых попадает на отрезок большого круга между ними
+    """
+
+    def __init__(self, path, road_factor=1.3, corridor_width=30):
+        """
+        :param path: Путь к csv файлу с колонками City, Latitude, Longitude
+        :param road_factor: Отношение расстояния по дорогам к расстоянию
+                по большому кругу
+        :param corridor_width: Максимальное удаление города
+                от отрезка большого круга в километрах
+        """
+        super().__init__()
+        self.road_factor = road_factor
+        self.corridor_width = corridor_width
+        self.coordinates = {}
+        with open(path) as csvfile:
+            reader = csv.DictReader(csvfile)
+            for i in reader:
+                self.coordinates[i['City']] = (
+                    math.radians(float(i['Latitude'])),
+                    math.radians(float(i['Longitude'])))
+
+    async def distance(self, start_city, end_city):
+        return [start_city, end_city, round(
+            haversine(self.coordinates[start_city],
+                      self.coordinates[end_city]) * self.road_factor)]
+
+    async def create_corridor(self, start_city, end_city):
+        start = self.coordinates[start_city]
+        end = self.coordinates[end_city]
+        length = haversine(start, end)
+        course = bearing(start, end)
+        cities = []
+        for name, point in self.coordinates.items():
+            if name in (start_city, end_city):
+                continue
+            distance = haversine(start, point)
+            angle = bearing(start, point) - course
+            cross_track = math.asin(math.sin(distance / EARTH_RADIUS)
+                                    * math.sin(angle))
+            along_track = EARTH_RADIUS * math.acos(
+                min(1.0, math.cos(distance / EARTH_RADIUS)
+                    / math.cos(cross_track)))
+            if math.cos(angle) > 0 and along_track < length \
+                    and abs(cross_track) * EARTH_RADIUS <= self.corridor_width:
+                cities.append((round(distance * self.road_factor), name))
+        cities.sort()
+        return Corridor([i[1] for i in cities], [i[0] for i in cities])
+
+
+def retrieve_exception(task):
+    """
+    Функция, забирающая ошибку завершённой задачи, чтобы asyncio
+    не сообщал о необработанной ошибке задачи, результат которой не нужен
+
+    :param task: Завершённая задача
+    """
+    if not task.cancelled():
+        task.exception()
+
+
+def haversine(start, end):
+    """
+    :param start: Широта и долгота первой точки в радианах
+    :param end: Широта и долгота второй точки в радианах
+    :return: Расстояние по большому кругу в километрах
+    """
+    a = math.sin((end[0] - start[0]) / 2) ** 2 + math.cos(start[0]) \
+        * math.cos(end[0]) * math.sin((end[1] - start[1]) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def bearing(start, end):
+    """
+    :param start: Широта и долгота первой точки в радианах
+    :param end: Широта и долгота второй точки в радианах
+    :return: Начальный азимут направления из первой точки на вторую
+    """
+    return math.atan2(
+        math.sin(end[1] - start[1]) * math.cos(end[0]),
+        math.cos(start[0]) * math.sin(end[0]) - math.sin(start[0])
+        * math.cos(end[0]) * math.cos(end[1] - start[1]))
+
+
+EARTH_RADIUS = 6371
@@ -0,0 +1,142 @@
+from datetime_handle import MINUTES_IN_HOUR, next_day, time_of_day, to_minutes
+from excursions import get_excursion_slots
+from graph import DistanceMatrix
+
+
+def schedule_course(cities, starting_city, graph, excursions, start_time,
+                    configs):
+    """
+    Функция, находящая маршрут с самым ранним возвращением в стартовый
+    город, а не самый короткий. Время поездки моделируется так же, как при
+    расстановке промежуточных городов: с ограничением времени за рулём
+    в день, ночёвками и ожиданием начала экскурсий.
+    Динамическое программирование по множеству посещённых городов,
+    последнему городу и времени: для каждой пары из множества и последнего
+    города хранятся только состояния, у которых нет другого состояния
+    с не более поздним временем и не большим временем за рулём
+
+    :param cities: Список городов с экскурсиями
+    :param starting_city: Стартовый город маршрута
+    :param graph: Матрица расстояний между городами
+    :param excursions: Список экскурсий в городах
+    :param start_time: Время отбытия из стартового города в минутах
+    :param configs: Конфигурация со скоростью и ограничениями времени
+    :return: Маршрут, начинающийся в стартовом городе
+    """
+    points = [starting_city] + list(cities)
+    matrix = DistanceMatrix.from_graph(graph).submatrix(points).tolist()
+    visits = [get_excursion_slots(excursions, i) for i in cities]
+    size = len(cities)
+    labels = {(0, -1): [(start_time, 0, None, -1)]}
+    for mask in range((1 << size) - 1):
+        for last in range(-1, size):
+            for label in labels.pop((mask, last), []):
+                for following in range(size):
+                    if mask >> following & 1:
+                        continue
+                    clock, drive_time = drive(
+                        label[0], label[1],
+                        matrix[last + 1][following + 1], configs)
+                    clock, drive_time = visit(clock, drive_time,
+                                              visits[following])
+                    add_label(labels, (mask | 1 << following, following),
+                              (clock, drive_time, label, following))
+    best = None
+    for last in range(size):
+        for label in labels[(1 << size) - 1, last]:
+            clock = drive(label[0], label[1], matrix[last + 1][0],
+                          configs)[0]
+            if best is None or clock < best[0]:
+                best = (clock, label)
+    course = []
+    label = best[1]
+    while label[3] != -1:
+        course.append(points[label[3] + 1])
+        label = label[2]
+    course.append(starting_city)
+    course.reverse()
+    return course
+
+
+def simulate_course(course, graph, excursions, start_time, configs):
+    """
+    Функция, рассчитывающая время возвращения в стартовый город
+    для переданного маршрута
+
+    :param course: Маршрут, начинающийся в стартовом городе
+    :param graph: Матрица расстояний между городами
+    :param excursions: Список экскурсий в городах
+    :param start_time: Время отбытия из стартового города в минутах
+    :param configs: Конфигурация со скоростью и ограничениями времени
+    :return: Время возвращения в минутах от полуночи первого дня
+    """
+    graph = DistanceMatrix.from_graph(graph)
+    clock, drive_time = start_time, 0
+    for index, city in enumerate(course[1:]):
+        clock, drive_time = drive(clock, drive_time,
+                                  graph.distance(course[index], city),
+                                  configs)
+        clock, drive_time = visit(clock, drive_time,
+                                  get_excursion_slots(excursions, city))
+    return drive(clock, drive_time,
+                 graph.distance(course[len(course) - 1], course[0]),
+                 configs)[0]
+
+
+def add_label(labels, key, label):
+    """
+    Функция, добавляющая состояние, если его не превосходит
+    другое состояние, и удаляющая состояния, которые оно превосходит
+
+    :param labels: Словарь состояний
+    :param key: Множество посещённых городов и последний город
+    :param label: Время, время за рулём в текущий день,
+            предыдущее состояние и последний город
+    """
+    current = labels.setdefault(key, [])
+    for i in current:
+        if i[0] <= label[0] and i[1] <= label[1]:
+            return
+    current[:] = [i for i in current
+                  if not (label[0] <= i[0] and label[1] <= i[1])]
+    current.append(label)
+
+
+def drive(clock, drive_time, distance, configs):
+    """
+    Функция, рассчитывающая время приезда с учётом ночёвок
+
+    :param clock: Время отбытия в минутах от полуночи первого дня
+    :param drive_time: Время за рулём в текущий день в минутах
+    :param distance: Расстояние до города
+    :param configs: Конфигурация со скоростью и ограничениями времени
+    :return: Время приезда и время за рулём в день приезда
+    """
+    while True:
+        max_driving_distance = min(
+            to_minutes(configs['driving time']) - drive_time,
+            to_minutes(configs['end']) - time_of_day(clock)
+        ) * configs['velocity'] / MINUTES_IN_HOUR
+        if distance < max_driving_distance:
+            travel_time = to_minutes(distance / configs['velocity'])
+            return clock + travel_time, drive_time + travel_time
+        distance -= max(max_driving_distance, 0)
+        clock = next_day(clock, to_minutes(configs['start']))
+        drive_time = 0
+
+
+def visit(clock, drive_time, excursion):
+    """
+    Функция, рассчитывающая время отбытия из города с экскурсией:
+    экскурсия начинается в ближайшее время начала после приезда,
+    либо в первое время начала на следующий день
+
+    :param clock: Время приезда в минутах от полуночи первого дня
+    :param drive_time: Время за рулём в день приезда
+    :param excursion: Разобранные данные экскурсии ExcursionSlots
+    :return: Время отбытия и время за рулём в день отбытия
+    """
+    time, following_day = excursion.next_start(time_of_day(clock))
+    if following_day:
+        return next_day(clock, time) + excursion.duration, 0
+    return clock - time_of_day(clock) + time + excursion.duration, drive_time
@@ -0,0 +1,264 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import itertools
+import json
+import os
+
+import aiohttp
+from aiohttp import web
+
+from cache import DistanceCache, create_key
+from courses import TourCache
+from excursions import Excursion, ExcursionCatalogue
+from graph import DistanceMatrix, create_distances
+from main import (add_planning_arguments, choose_course, configs,
+                  create_fetcher, create_provider, create_record,
+                  get_excursions, parse_start_date, plan_course)
+from profiling import profiler
+
+
+class PlannerService:
+    """
+    Класс долго работающего сервиса расчёта маршрутов: принимает задания
+    по HTTP через TCP порт либо Unix сокет и считает их тем же конвейером,
+    что и main, в одном цикле событий. Сессия, источник расстояний
+    со списками городов между двумя городами, расстояния, найденные
+    маршруты и прочитанные файлы экскурсий хранятся в памяти между
+    заданиями, поэтому повторные задания по тем же городам не обращаются
+    к сети и не ищут маршрут заново. В памяти хранятся только
+    service cache size последних использованных расстояний, списков
+    городов и файлов экскурсий. Порядок городов ищется в отдельном
+    потоке, чтобы долгий перебор не останавливал остальные задания
+    """
+
+    def __init__(self, solver="brute_force", distance_cache=None,
+                 gazetteer=None, host='127.0.0.1', port=0, socket=None):
+        """
+        :param solver: Способ поиска маршрута для заданий, где он не указан
+        :param distance_cache: Путь к хранилищу расстояний,
+                может отсутствовать
+        :param gazetteer: Путь к файлу координат городов, может отсутствовать
+        :param host: Адрес сервиса
+        :param port: Порт сервиса, по умолчанию любой свободный
+        :param socket: Путь к Unix сокету, если передан, порт не открывается
+        """
+        self.solver = solver
+        self.distance_cache = distance_cache
+        self.gazetteer = gazetteer
+        self.host = host
+        self.port = port
+        self.socket = socket
+        self.size = configs['service cache size']
+        self.distances = collections.OrderedDict()
+        self.excursions = collections.OrderedDict()
+        self.fetcher = None
+        self.cache = None
+        self.provider = None
+        self.tours = None
+        self.executor = None
+        self.runner = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}/'.format(self.host, self.port)
+
+    async def __aenter__(self):
+        if self.distance_cache and not self.gazetteer:
+            self.cache = DistanceCache(self.distance_cache,
+                                       configs['cache ttl'])
+        self.fetcher = await create_fetcher().__aenter__()
+        self.provider = create_provider(self.gazetteer, self.fetcher,
+                                        self.cache)
+        self.provider.size = self.size
+        self.executor = concurrent.futures.ThreadPoolExecutor(1)
+        await asyncio.get_event_loop().run_in_executor(self.executor,
+                                                       self.create_tours)
+        app = web.Application()
+        app.router.add_post('/plan', self.handle_plan)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        if self.socket:
+            site = web.UnixSite(self.runner, self.socket)
+        else:
+            site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        if not self.socket:
+            self.port = self.runner.addresses[0][1]
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.runner.cleanup()
+        await asyncio.get_event_loop().run_in_executor(self.executor,
+                                                       self.close_tours)
+        self.executor.shutdown()
+        await self.fetcher.__aexit__(exc_type, exc, tb)
+        if self.cache:
+            self.cache.close()
+
+    async def handle_plan(self, request):
+        """
+        Обработчик задания в формате JSON с полями input_file либо
+        excursions, starting_city, start_date и необязательным solver
+
+        :param request: Запрос с заданием
+        :return: Ответ со списком городов маршрута в виде словарей
+                с колонками COLUMNS, либо ошибка 400 для неверного задания,
+                либо ошибка 502, если расстояние или список городов
+                не получены
+        """
+        try:
+            job = await request.json()
+            excursions = self.get_excursions(job)
+            starting_city = job['starting_city']
+            current_datetime, current_time = \
+                parse_start_date(job.get('start_date'))
+        except (ValueError, KeyError, IndexError, TypeError, OSError) as e:
+            raise web.HTTPBadRequest(text=repr(e))
+        cities = [i.city for i in excursions] + [starting_city]
+        solver = job.get('solver', self.solver)
+        try:
+            graph = await self.create_graph(cities)
+            current_course = await asyncio.get_event_loop().run_in_executor(
+                self.executor, choose_course, excursions, starting_city,
+                graph, current_time, solver, self.tours)
+            course = await plan_course(excursions, starting_city, graph,
+                                       current_datetime, current_time,
+                                       solver, self.provider, self.tours,
+                                       current_course)
+        except (ValueError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise web.HTTPBadGateway(text=repr(e))
+        return web.json_response(
+            [create_record([i.name, i.arrival, i.leaving, i.stop_name])
+             for i in course],
+            dumps=functools.partial(json.dumps, ensure_ascii=False))
+
+    def get_excursions(self, job):
+        """
+        :param job: Задание с путём к файлу экскурсий input_file либо
+                списком экскурсий excursions из словарей с полями name, city,
+                start_time, duration
+        :return: Список экскурсий ExcursionCatalogue, прочитанные файлы
+                хранятся, пока не изменятся
+        """
+        if 'excursions' in job:
+            return ExcursionCatalogue(
+                Excursion(i['name'], i['city'], i['start_time'],
+                          i['duration']) for i in job['excursions'])
+        path = job['input_file']
+        mtime = os.path.getmtime(path)
+        if self.excursions.get(path, (None,))[0] != mtime:
+            self.excursions[path] = (mtime, get_excursions(path))
+        self.remember(self.excursions, [path])
+        return self.excursions[path][1]
+
+    async def create_graph(self, cities):
+        """
+        Функция, создающая матрицу расстояний для переданных городов.
+        Отсутствующие в памяти расстояния запрашиваются одной задачей,
+        которую ждут и одновременные задания с теми же городами
+
+        :param cities: Список городов
+        :return: Матрица расстояний DistanceMatrix
+        """
+        pairs = list(dict.fromkeys(
+            create_key(i, j)
+            for i, j in itertools.combinations(dict.fromkeys(cities), 2)))
+        missing = [i for i in pairs if i not in self.distances]
+        if missing:
+            task = asyncio.ensure_future(self.fetch_distances(missing))
+            for key in missing:
+                self.distances[key] = task
+        tasks = {key: self.distances[key] for key in pairs}
+        self.remember(self.distances, pairs)
+        await asyncio.gather(*set(tasks.values()))
+        graph = dict()
+        for key in pairs:
+            graph.setdefault(key[0], {})[key[1]] = tasks[key].result()[key]
+        return DistanceMatrix.from_graph(graph)
+
+    async def fetch_distances(self, pairs):
+        """
+        :param pairs: Пары городов, расстояний между которыми нет в памяти
+        :return: Словарь пара городов - расстояние. Если запрос не удался
+                либо расстояние для какой-то пары не найдено, пары
+                удаляются из памяти, чтобы следующее задание запросило
+                их снова, во втором случае возникает ValueError
+        """
+        graph = dict()
+        for i, j in pairs:
+            graph.setdefault(i, {})[j] = 0
+        try:
+            distances = await create_distances(graph, self.cache,
+                                               self.provider)
+            distances = {create_key(i[0], i[1]): i[2]
+                         for i in distances if i}
+            failed = [i for i in pairs if i not in distances]
+            if failed:
+                raise ValueError('No road distance for {}'.format(failed))
+        except Exception:
+            task = asyncio.current_task()
+            for key in pairs:
+                if self.distances.get(key) is task:
+                    del self.distances[key]
+            raise
+        return distances
+
+    def remember(self, memo, keys):
+        """
+        Функция, отмечающая записи как последние использованные и удаляющая
+        самые давние записи сверх service cache size
+
+        :param memo: Словарь OrderedDict
+        :param keys: Использованные ключи
+        """
+        for key in keys:
+            memo.move_to_end(key)
+        while len(memo) > self.size:
+            memo.popitem(last=False)
+
+    def create_tours(self):
+        """
+        Функция, создающая в потоке поиска маршрутов хранилище найденных
+        маршрутов. Файл хранилища открывается отдельным соединением,
+        так как соединение SQLite нельзя использовать из другого потока
+        """
+        store = None
+        if self.distance_cache and not self.gazetteer:
+            store = DistanceCache(self.distance_cache, configs['cache ttl'])
+        self.tours = TourCache(configs['tour cache size'], store)
+
+    def close_tours(self):
+        if self.tours.store:
+            self.tours.store.close()
+
+
+async def main():
+    """
+    Функция, запускающая сервис с параметрами из командной строки
+    до прерывания
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket", default=None)
+    add_planning_arguments(parser)
+    args = parser.parse_args()
+    if args.profile:
+        profiler.enable()
+    async with PlannerService(args.solver, args.distance_cache,
+                              args.gazetteer, args.host, args.port,
+                              args.socket) as service:
+        print('Listening on', args.socket or service.url)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            if args.profile:
+                profiler.dump(args.profile)
+
+
+if __name__ == "__main__":
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main())
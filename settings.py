@@ -0,0 +1,4 @@
+import json
+
+with open('config.json') as f:
+    configs = json.load(f)
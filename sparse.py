@@ -0,0 +1,121 @@
+import heapq
+
+from cache import create_key
+from graph import create_distances
+from profiling import profiler
+from providers import haversine
+
+
+def estimate_distances(cities, coordinates):
+    """
+    Функция, оценивающая расстояния между городами расстоянием
+    по большому кругу, которое не больше расстояния по дорогам
+
+    :param cities: Список городов
+    :param coordinates: Словарь город - широта и долгота в радианах
+    :return: Словарь пара городов - оценка расстояния, только для городов
+            с известными координатами
+    """
+    located = [i for i in dict.fromkeys(cities) if i in coordinates]
+    return {create_key(i, j): haversine(coordinates[i], coordinates[j])
+            for index, i in enumerate(located) for j in located[index + 1:]}
+
+
+def choose_candidates(cities, estimates, neighbours):
+    """
+    Функция, выбирающая рёбра, расстояния для которых запрашиваются сразу:
+    рёбра от каждого города до neighbours ближайших по оценке городов
+    и все рёбра городов без координат
+
+    :param cities: Список городов
+    :param estimates: Оценки расстояний функции estimate_distances
+    :param neighbours: Количество ближайших городов
+    :return: Множество пар городов
+    """
+    cities = list(dict.fromkeys(cities))
+    candidates = set()
+    for i in cities:
+        keys = [create_key(i, j) for j in cities if j != i]
+        located = [key for key in keys if key in estimates]
+        candidates.update(key for key in keys if key not in estimates)
+        candidates.update(heapq.nsmallest(neighbours, located,
+                                          key=estimates.__getitem__))
+    return candidates
+
+
+async def create_sparse_graph(cities, coordinates, neighbours, cache=None,
+                              provider=None):
+    """
+    Функция, создающая граф в формате функции create_graph, в котором
+    расстояния по дорогам запрошены только для рёбер функции
+    choose_candidates, а остальные рёбра заполнены оценками
+
+    :param cities: Список городов, для которого создаётся граф
+    :param coordinates: Словарь город - широта и долгота в радианах
+    :param neighbours: Количество ближайших городов каждого города
+    :param cache: Хранилище расстояний DistanceCache, может отсутствовать
+    :param provider: Источник расстояний DistanceProvider, по умолчанию
+            расстояния запрашиваются у внешнего сайта
+    :return: Матрица расстояний и множество пар городов, расстояние
+            между которыми пока только оценено
+    """
+    estimates = estimate_distances(cities, coordinates)
+    graph = dict()
+    for key, distance in estimates.items():
+        graph.setdefault(key[0], {})[key[1]] = distance
+    candidates = choose_candidates(cities, estimates, neighbours)
+    await fetch_edges(graph, candidates, cache, provider)
+    return graph, set(estimates) - candidates
+
+
+async def resolve_course(choose, graph, estimated, cache=None, provider=None):
+    """
+    Функция, ищущая маршрут по графу с оценёнными рёбрами: если маршрут
+    проходит по оценённым рёбрам, для них запрашиваются расстояния
+    по дорогам, и маршрут ищется заново. Оценки не больше расстояний
+    по дорогам, поэтому маршрут, проходящий только по запрошенным рёбрам,
+    не хуже маршрута, который был бы найден по полному графу
+
+    :param choose: Функция, принимающая матрицу расстояний
+            и возвращающая маршрут
+    :param graph: Матрица расстояний функции create_sparse_graph,
+            дополняется запрошенными расстояниями
+    :param estimated: Множество оценённых пар городов, из него удаляются
+            запрошенные пары
+    :param cache: Хранилище расстояний DistanceCache, может отсутствовать
+    :param provider: Источник расстояний DistanceProvider, может отсутствовать
+    :return: Маршрут, проходящий только по запрошенным рёбрам
+    """
+    while True:
+        course = choose(graph)
+        edges = {create_key(i, j) for i, j in
+                 zip(course, course[1:] + course[:1])} & estimated
+        if not edges:
+            return course
+        profiler.count('lazy distances', len(edges))
+        estimated -= edges
+        await fetch_edges(graph, edges, cache, provider)
+
+
+async def fetch_edges(graph, pairs, cache=None, provider=None):
+    """
+    Функция, запрашивающая расстояния по дорогам для переданных пар городов
+    и записывающая их в граф. Если расстояние для какой-то пары
+    не получено, возникает ValueError
+
+    :param graph: Матрица расстояний в формате функции create_graph
+    :param pairs: Пары городов в порядке функции create_key
+    :param cache: Хранилище расстояний DistanceCache, может отсутствовать
+    :param provider: Источник расстояний DistanceProvider, может отсутствовать
+    """
+    missing = dict()
+    for i, j in pairs:
+        missing.setdefault(i, {})[j] = 0
+    fetched = set()
+    for i in await create_distances(missing, cache, provider):
+        if i:
+            graph.setdefault(i[0], {})[i[1]] = i[2]
+            fetched.add((i[0], i[1]))
+    failed = [i for i in pairs if i not in fetched]
+    if failed:
+        raise ValueError('No road distance for {}'.format(failed))
@@ -0,0 +1,113 @@
+import argparse
+import asyncio
+import os
+import random
+
+from aiohttp import web
+
+
+class StandinServer:
+    """
+    Класс локального сервера, заменяющего travelmath.com и citiesbetween.com
+    при нагрузочном тестировании без сети: на любой запрос расстояния
+    или списка городов между двумя городами отвечает записанной страницей
+    с заданной задержкой, разбросом задержки и долей ошибок
+    """
+
+    def __init__(self, fixtures='tests/fixtures', latency=0.0, jitter=0.0,
+                 error_rate=0.0, seed=None, host='127.0.0.1', port=0):
+        """
+        :param fixtures: Папка с записанными страницами travelmath.html
+                и citiesbetween.html
+        :param latency: Средняя задержка ответа в секундах
+        :param jitter: Максимальное отклонение задержки в секундах
+        :param error_rate: Доля запросов, на которые отвечается ошибкой 503
+        :param seed: Начальное значение генератора случайных чисел
+        :param host: Адрес сервера
+        :param port: Порт сервера, по умолчанию любой свободный
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.host = host
+        self.port = port
+        self.pages = {}
+        for name in ('travelmath', 'citiesbetween'):
+            with open(os.path.join(fixtures, name + '.html')) as f:
+                self.pages[name] = f.read()
+        self.requests = 0
+        self.errors = 0
+        self.runner = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}/'.format(self.host, self.port)
+
+    @property
+    def distance_url(self):
+        return self.url + 'drive-distance/from/'
+
+    @property
+    def corridor_url(self):
+        return self.url + 'between/'
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get('/drive-distance/from/{start_city}/to/{end_city}',
+                           self.handle_distance)
+        app.router.add_get('/between/{cities}', self.handle_corridor)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.runner.cleanup()
+
+    async def handle_distance(self, request):
+        return await self.respond('travelmath')
+
+    async def handle_corridor(self, request):
+        return await self.respond('citiesbetween')
+
+    async def respond(self, name):
+        """
+        :param name: Название записанной страницы
+        :return: Ответ со страницей либо ошибкой 503 после задержки
+        """
+        self.requests += 1
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        await asyncio.sleep(max(delay, 0))
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=503, text='Service Unavailable')
+        return web.Response(text=self.pages[name], content_type='text/html')
+
+
+async def main():
+    """
+    Функция, запускающая сервер до прерывания с параметрами
+    из командной строки и выводящая адреса для config.json
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", default='tests/fixtures')
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    async with StandinServer(args.fixtures, args.latency, args.jitter,
+                             args.error_rate, args.seed,
+                             port=args.port) as server:
+        print('"distance url" :', '"' + server.distance_url + '"')
+        print('"corridor url" :', '"' + server.corridor_url + '"')
+        await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main())
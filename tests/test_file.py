@@ -1,16 +1,41 @@
+import asyncio
+import contextlib
 import datetime
+import time
 import json
+import os
+import random
 
+import aiohttp
 import csv
 import mock
 import pytest
 
 from main import (complete_course, create_course_with_middle_cities,
-                  create_excursion_city, get_excursions,
-                  put_middle_city, write_course, City, Excursion)
-from courses import (create_courses, count_course)
+                  create_excursion_city, create_provider, find_middle_city,
+                  get_excursions, iterate_course, plan_course, plan_stops,
+                  put_middle_city, stream_course, write_course, City,
+                  Excursion)
+from courses import (branch_and_bound_course, brute_force_course,
+                     create_courses, count_course,
+                     enumerate_tours, greedy_course, held_karp_course,
+                     heuristic_course, parallel_course, update_course,
+                     TourCache)
 from datetime_handle import create_datetime
-from graph import create_graph
+from batch import plan_batch
+from benchmarks.bench_suite import compare
+from cache import DistanceCache
+from fetcher import Fetcher
+from graph import (DistanceMatrix, create_distances, create_graph,
+                   extend_graph, get_distance)
+from parsing import parse_corridor, parse_drive_distance
+from profiling import Profiler
+from providers import (Corridor, DistanceProvider, GazetteerProvider,
+                       ScrapingProvider)
+from schedule import schedule_course, simulate_course
+from service import PlannerService
+from sparse import create_sparse_graph, estimate_distances, resolve_course
+from standin import StandinServer
 
 
 def test_read_configs():
@@ -30,6 +55,56 @@ def test_read_excursions():
     assert excursions[0].name == "Best churches"
 
 
+@pytest.mark.asyncio
+async def test_stream_course_jsonl(tmp_path, capsys):
+    """
+    Тест записи городов маршрута в формате JSON Lines по мере их получения
+    """
+    async def stops():
+        yield City('Berlin', None, datetime.datetime(2021, 11, 15, 8),
+                   'starting point')
+        yield City('Berlin', datetime.datetime(2021, 11, 16, 8), None,
+                   'Ending point')
+
+    count = await stream_course(stops(), str(tmp_path / 'output.jsonl'),
+                                'jsonl')
+    with open(tmp_path / 'output.jsonl') as f:
+        rows = [json.loads(i) for i in f]
+    assert count == 2
+    assert rows[0]['Время приезда'] is None
+    assert rows[1]['Время приезда'] == '2021-11-16 08:00:00'
+    assert capsys.readouterr().out == ''
+
+
+@pytest.mark.asyncio
+async def test_iterate_course_yields_final_leaving():
+    """
+    Тест выдачи города только после изменения его времени отбытия
+    """
+    current_datetime = datetime.datetime(year=1, month=1, day=2)
+    with mock.patch('main.put_middle_city') as MockClass:
+        MockClass.side_effect = [[City('B', 1, 1, 'Tour'),
+                                  [0, 2040], True],
+                                 [City('A', 1, None, 'Ending point'), None]]
+        stops = [(i.name, i.leaving) async for i in iterate_course(
+            ['A', 'B'], None, {'A': {'B': 100}},
+            datetime.datetime(year=1, month=1, day=1), 480, 'A')]
+    assert stops[0] == ('A', create_datetime(current_datetime, 8))
+    assert [i[0] for i in stops] == ['A', 'B', 'A']
+
+
+def test_excursion_catalogue():
+    """
+    Тест разбора времён начала экскурсий при чтении файла
+    """
+    excursions = get_excursions("excursions.csv")
+    slots = excursions.by_city[excursions[0].city]
+    assert slots.times == sorted(slots.times)
+    assert slots.next_start(slots.times[0]) == (slots.times[1], False)
+    assert slots.next_start(slots.times[-1]) == (slots.times[0], True)
+    assert slots.duration == int(excursions[0].duration[:-1]) * 60
+
+
 def test_write_course():
     """
     Тест записи городов в csv файла
@@ -58,6 +133,62 @@ async def test_graph_creation():
         assert graph[1][2] == 20
 
 
+def test_distance_cache(tmp_path):
+    """
+    Тест хранения расстояний независимо от направления поездки
+    """
+    cache = DistanceCache(str(tmp_path / 'distances.sqlite'))
+    cache.put_many([['Berlin', 'Frankfurt', 545]])
+    assert cache.get_many([('Frankfurt', 'Berlin'), ('Berlin', 'Bonn')]) \
+        == {('Frankfurt', 'Berlin'): 545}
+    cache.ttl = -1
+    assert cache.get_many([('Berlin', 'Frankfurt')]) == {}
+    cache.close()
+
+
+@pytest.mark.asyncio
+async def test_create_distances_with_cache(tmp_path):
+    """
+    Тест запроса у внешнего сайта только отсутствующих в хранилище расстояний
+    """
+    cache = DistanceCache(str(tmp_path / 'distances.sqlite'))
+    cache.put_many([['A', 'B', 20]])
+    with mock.patch('graph.create_distance') as AsyncMock:
+        AsyncMock.return_value = ['A', 'C', 30]
+        distances = await create_distances({'A': {'B': 0, 'C': 0}}, cache)
+        AsyncMock.assert_called_once_with('A', 'C')
+    assert sorted(distances) == [['A', 'B', 20], ['A', 'C', 30]]
+    assert cache.get_many([('C', 'A')]) == {('C', 'A'): 30}
+    cache.close()
+
+
+@pytest.mark.asyncio
+async def test_fetcher_limit_per_host():
+    """
+    Тест ограничения количества одновременных запросов к одному сайту
+    """
+    active = []
+    peak = []
+
+    @contextlib.asynccontextmanager
+    async def get(url):
+        active.append(url)
+        peak.append(len(active))
+        await asyncio.sleep(0.01)
+        response = mock.Mock()
+        response.text = mock.AsyncMock(return_value=url)
+        yield response
+        active.remove(url)
+
+    fetcher = Fetcher(limit_per_host=2)
+    fetcher.session = mock.Mock(get=get)
+    pages = await asyncio.gather(
+        *[fetcher.get_text('https://a.com/' + str(i)) for i in range(5)],
+        fetcher.get_text('https://b.com/'))
+    assert pages[5] == 'https://b.com/'
+    assert max(peak) == 3
+
+
 def test_create_courses_one():
     """
     Тест генерации случайной последовательности городов
@@ -90,6 +221,301 @@ async def test_count_course():
         assert count_course([1, 2, 3, 4], graph) == 140
 
 
+def random_graph(cities, seed=0):
+    """
+    Создание симметричной матрицы графа со случайными расстояниями
+    """
+    generator = random.Random(seed)
+    graph = dict()
+    for index, i in enumerate(cities[:len(cities) - 1]):
+        graph[i] = {j: generator.randint(10, 500)
+                    for j in cities[index + 1:]}
+    return graph
+
+
+@pytest.mark.asyncio
+async def test_distance_matrix_symmetric():
+    """
+    Тест создания симметричной матрицы расстояний по графу
+    """
+    with mock.patch('graph.create_distances') as AsyncMock:
+        AsyncMock.return_value = [[1, 2, 20], [1, 3, 30], [2, 3, 10]]
+        graph = DistanceMatrix.from_graph(await create_graph([1, 2, 3]))
+        assert graph.distance(3, 1) == graph.distance(1, 3) == 30
+        assert graph.distance(2, 2) == 0
+
+
+def test_enumerate_tours():
+    """
+    Тест перебора каждого замкнутого маршрута ровно один раз
+    с правильной длиной
+    """
+    cities = ['A', 'B', 'C', 'D', 'E', 'F']
+    graph = random_graph(cities)
+    matrix = DistanceMatrix.from_graph(graph).submatrix(cities).tolist()
+    tours = []
+    for distance, course in enumerate_tours(matrix):
+        assert distance == count_course([cities[i] for i in course], graph)
+        tours.append(tuple(course))
+    assert len(set(tours)) == len(tours) == 60
+    assert not {i[:1] + i[:0:-1] for i in tours} & set(tours)
+
+
+def test_held_karp_course_matches_brute_force():
+    """
+    Тест совпадения длины маршрута Хелда-Карпа с полным перебором
+    """
+    cities = ['A', 'B', 'C', 'D', 'E', 'F', 'G']
+    graph = random_graph(cities)
+    expected = brute_force_course(cities[1:], 'A', graph)
+    course = held_karp_course(cities[1:], 'A', graph)
+    assert course[0] == 'A'
+    assert sorted(course) == sorted(cities)
+    assert count_course(course, graph) == count_course(expected, graph)
+
+
+def test_held_karp_course_one_city():
+    """
+    Тест маршрута Хелда-Карпа из одного города с экскурсией
+    """
+    graph = random_graph(['A', 'B'])
+    assert held_karp_course(['B'], 'A', graph) == ['A', 'B']
+
+
+def test_branch_and_bound_course_matches_held_karp():
+    """
+    Тест совпадения длины маршрута метода ветвей и границ с Хелдом-Карпом
+    """
+    cities = [str(i) for i in range(11)]
+    graph = random_graph(cities, seed=1)
+    expected = held_karp_course(cities[1:], '0', graph)
+    course = branch_and_bound_course(cities[1:], '0', graph)
+    assert course[0] == '0'
+    assert sorted(course) == sorted(cities)
+    assert count_course(course, graph) == count_course(expected, graph)
+
+
+def test_heuristic_course_improves_greedy_course():
+    """
+    Тест улучшения жадного маршрута локальным поиском
+    """
+    cities = [str(i) for i in range(60)]
+    graph = random_graph(cities, seed=2)
+    matrix = DistanceMatrix.from_graph(graph)
+    greedy = [cities[i] for i
+              in greedy_course(matrix.submatrix(cities).tolist())]
+    course = heuristic_course(cities[1:], '0', graph)
+    assert course[0] == '0'
+    assert sorted(course) == sorted(cities)
+    assert count_course(course, graph) < count_course(greedy, graph)
+
+
+def test_heuristic_course_two_excursions():
+    """
+    Тест локального поиска на маршруте из трёх городов
+    """
+    graph = random_graph(['A', 'B', 'C'], seed=3)
+    course = heuristic_course(['B', 'C'], 'A', graph)
+    assert course[0] == 'A' and sorted(course) == ['A', 'B', 'C']
+
+
+def test_parallel_course_matches_brute_force():
+    """
+    Тест совпадения маршрута перебора в нескольких процессах с полным
+    перебором при равных длинах маршрутов
+    """
+    cities = ['A', 'B', 'C', 'D', 'E', 'F']
+    graph = {i: {j: 10 for j in cities[index + 1:]}
+             for index, i in enumerate(cities[:len(cities) - 1])}
+    course = parallel_course(cities[1:], 'A', graph, workers=2)
+    assert course == parallel_course(cities[1:], 'A', graph, workers=3)
+    assert course == brute_force_course(cities[1:], 'A', graph)
+    graph = random_graph(cities, seed=3)
+    course = parallel_course(cities[1:], 'A', graph, workers=2)
+    expected = brute_force_course(cities[1:], 'A', graph)
+    assert count_course(course, graph) == count_course(expected, graph)
+
+
+def test_update_course():
+    """
+    Тест перестроения маршрута после добавления и удаления городов
+    """
+    cities = ['A', 'B', 'C', 'D', 'E', 'F', 'G']
+    graph = random_graph(cities, seed=6)
+    course = held_karp_course(cities[1:5], 'A', graph)
+    added = update_course(course, cities[1:], 'A', graph)
+    removed = update_course(added, ['B', 'D', 'G'], 'A', graph)
+    assert added[0] == 'A' and sorted(added) == cities
+    assert removed[0] == 'A' and sorted(removed) == ['A', 'B', 'D', 'G']
+    assert count_course(removed, graph) == \
+        count_course(held_karp_course(['B', 'D', 'G'], 'A', graph), graph)
+    assert count_course(added, graph) == \
+        count_course(held_karp_course(cities[1:], 'A', graph), graph)
+    assert sorted(update_course(added, ['C', 'E'], 'A', graph)) == \
+        ['A', 'C', 'E']
+
+
+@pytest.mark.asyncio
+async def test_extend_graph():
+    """
+    Тест запроса расстояний только для новых пар городов
+    """
+    graph = {'A': {'B': 10, 'C': 20}, 'B': {'C': 30}}
+
+    async def distance(start_city, end_city):
+        return [start_city, end_city, 5]
+
+    provider = mock.Mock(distance=mock.Mock(side_effect=distance))
+    extended = await extend_graph(graph, ['A', 'B', 'D', 'C'], None,
+                                  provider)
+    assert provider.distance.call_count == 3
+    assert extended['A'] == {'B': 10, 'C': 20, 'D': 5}
+    assert get_distance(extended, 'C', 'D') == 5
+    assert graph == {'A': {'B': 10, 'C': 20}, 'B': {'C': 30}}
+
+    async def failing_distance(start_city, end_city):
+        return None
+
+    provider = mock.Mock(distance=mock.Mock(side_effect=failing_distance))
+    with pytest.raises(ValueError):
+        await extend_graph(graph, ['A', 'B', 'E'], None, provider)
+
+
+@pytest.mark.asyncio
+async def test_sparse_graph():
+    """
+    Тест запроса расстояний только для ближайших городов и тех рёбер,
+    по которым проходит найденный маршрут
+    """
+    generator = random.Random(0)
+    cities = ['City{}'.format(i) for i in range(9)]
+    coordinates = {i: (generator.uniform(0.8, 0.9),
+                       generator.uniform(0.1, 0.3)) for i in cities}
+    roads = dict()
+    for key, distance in estimate_distances(cities, coordinates).items():
+        roads.setdefault(key[0], {})[key[1]] = \
+            distance * generator.uniform(1.1, 1.6)
+    full = DistanceMatrix.from_graph(roads)
+
+    async def distance(start_city, end_city):
+        return [start_city, end_city, full.distance(start_city, end_city)]
+
+    provider = mock.Mock(distance=mock.Mock(side_effect=distance))
+    graph, estimated = await create_sparse_graph(cities, coordinates, 2,
+                                                 None, provider)
+    fetched = provider.distance.call_count
+    assert fetched + len(estimated) == 36
+    assert fetched < 36
+    course = await resolve_course(
+        lambda matrix: held_karp_course(cities[1:], cities[0],
+                                        DistanceMatrix.from_graph(matrix)),
+        graph, estimated, None, provider)
+    assert provider.distance.call_count < 36
+    assert count_course(course, full) == pytest.approx(
+        count_course(held_karp_course(cities[1:], cities[0], full), full))
+
+    async def failing_distance(start_city, end_city):
+        return None
+
+    provider = mock.Mock(distance=mock.Mock(side_effect=failing_distance))
+    with pytest.raises(ValueError):
+        await create_sparse_graph(cities + ['Nowhere'], coordinates, 2,
+                                  None, provider)
+
+
+def test_tour_cache(tmp_path):
+    """
+    Тест повторного использования маршрута при другом стартовом городе
+    и порядке городов, в том числе из хранилища
+    """
+    cities = ['A', 'B', 'C', 'D', 'E']
+    graph = random_graph(cities, seed=5)
+    store = DistanceCache(str(tmp_path / 'distances.sqlite'))
+    tours = TourCache(size=1, store=store)
+    with mock.patch.dict('courses.SOLVERS', {'brute_force': mock.Mock(
+            side_effect=brute_force_course)}) as solvers:
+        first = tours.course('brute_force', cities[1:], 'A', graph)
+        second = tours.course('brute_force', ['E', 'A', 'C', 'B'], 'D', graph)
+        assert solvers['brute_force'].call_count == 1
+        graph['A']['B'] += 1
+        tours.course('brute_force', cities[1:], 'A', graph)
+        graph['A']['B'] -= 1
+        assert solvers['brute_force'].call_count == 2
+        assert TourCache(store=store).course('brute_force', cities[:4], 'E',
+                                             graph)[0] == 'E'
+        assert solvers['brute_force'].call_count == 2
+    assert first == brute_force_course(cities[1:], 'A', graph)
+    assert second[0] == 'D'
+    assert count_course(second, graph) == count_course(first, graph)
+    assert len(tours.tours) == 1
+    store.close()
+    repeated = TourCache()
+    repeated.course('held_karp', ['B', 'B', 'C'], 'A', graph)
+    assert sorted(repeated.course('held_karp', ['B', 'C'], 'A', graph)) == \
+        ['A', 'B', 'C']
+
+
+def test_schedule_course_finishes_earliest():
+    """
+    Тест нахождения маршрута с самым ранним возвращением
+    """
+    with open('config.json') as f:
+        configs = json.load(f)
+    cities = ['A', 'B', 'C', 'D', 'E']
+    graph = random_graph(cities, seed=4)
+    excursions = [Excursion('Tour', 'B', '09:00, 18:00', '2h'),
+                  Excursion('Tour', 'C', '10:00', '3h'),
+                  Excursion('Tour', 'D', '12:00, 14:00, 16:00', '1h'),
+                  Excursion('Tour', 'E', '08:00, 20:00', '4h')]
+    course = schedule_course(cities[1:], 'A', graph, excursions, 480,
+                             configs)
+    expected = min(simulate_course(['A'] + i, graph, excursions, 480, configs)
+                   for i in create_courses(cities[1:]))
+    assert course[0] == 'A'
+    assert sorted(course) == sorted(cities)
+    assert simulate_course(course, graph, excursions, 480, configs) \
+        == expected
+
+
+def test_benchmark_compare():
+    """
+    Тест обнаружения регрессий при сравнении с базовыми замерами
+    """
+    baseline = {'a': {'time': 1, 'value': 10}, 'b': {'time': 1, 'value': 10},
+                'c': {'time': 1, 'value': 10}}
+    results = {'a': {'time': 1.2, 'value': 10}, 'b': {'time': 3, 'value': 10},
+               'c': {'time': 1, 'value': 11}, 'd': {'time': 5, 'value': 1}}
+    regressions = compare(results, baseline, 1.5)
+    assert [i.split(':')[0] for i in regressions] == ['b', 'c']
+    results['b']['io'] = True
+    regressions = compare(results, baseline, 1.5, 4)
+    assert [i.split(':')[0] for i in regressions] == ['c']
+
+
+def test_profiler():
+    """
+    Тест сбора времени этапов и счётчиков только после включения
+    """
+    profiler = Profiler()
+    with profiler.stage('solver'):
+        profiler.count('permutations', 10)
+    assert profiler.report()['stages'] == {}
+    assert profiler.report()['counters'] == {}
+    profiler.enable()
+    with mock.patch('courses.profiler', profiler):
+        with profiler.stage('solver'):
+            brute_force_course(['B', 'C', 'D', 'E'], 'A',
+                               random_graph(['A', 'B', 'C', 'D', 'E'], 1))
+    profiler.request('example.com', 0.2)
+    profiler.request('example.com', 0.4)
+    report = profiler.report()
+    assert report['stages']['solver']['calls'] == 1
+    assert report['counters'] == {'permutations': 12}
+    assert report['permutations per second'] > 0
+    assert report['http']['example.com']['requests'] == 2
+    assert report['http']['example.com']['max'] == 0.4
+
+
 def test_create_datetime():
     """
     Тест задания времени в формате часы, минуты по времени в часах
@@ -105,9 +531,8 @@ async def test_put_middle_city_in_finish_course():
     """
     Тест нахождения завершающего тур города
     """
-    middle_city = await put_middle_city("A", "B", 0, 8, 70, starting_city="B",
-                                        current_datetime=datetime.datetime(
-                                            year=1, month=1, day=1))
+    middle_city = await put_middle_city("A", "B", 0, 480, 70,
+                                        starting_city="B")
     assert middle_city[0].name == 'B'
 
 
@@ -118,7 +543,7 @@ async def test_put_middle_city_distance_less_than_max():
     """
     with mock.patch('main.create_excursion_city') as MockClass:
         MockClass.return_value = 1
-        middle_city = await put_middle_city("A", "B", 0, 8, 70, None)
+        middle_city = await put_middle_city("A", "B", 0, 480, 70, None)
         assert middle_city == 1
 
 
@@ -129,9 +554,7 @@ async def test_put_middle_city_distance_more_than_max_distance_next_less_than_ma
     """
     with mock.patch('main.find_middle_city') as MockClass:
         MockClass.return_value = [1, 1]
-        middle_city = await put_middle_city("A", "B", 6, 8, 280,
-                                            current_datetime=datetime.datetime(
-                                                year=1, month=1, day=1))
+        middle_city = await put_middle_city("A", "B", 360, 480, 280)
         assert middle_city[0].name == 1
 
 
@@ -142,9 +565,7 @@ async def test_put_middle_city_in_distance_more_than_max_distance_next_more_than
     """
     with mock.patch('main.find_middle_city') as MockClass:
         MockClass.side_effect = [[1, 1], [2, 2]]
-        middle_city = await put_middle_city("A", "B", 6, 8, 280,
-                                            current_datetime=datetime.datetime(
-                                                year=1, month=1, day=1))
+        middle_city = await put_middle_city("A", "B", 360, 480, 280)
         assert middle_city[0].name == 1
 
 
@@ -155,10 +576,8 @@ async def test_put_middle_city_in_finish_course_distance_more_than_max_distance_
     """
     with mock.patch('main.find_middle_city') as MockClass:
         MockClass.return_value = None
-        middle_city = await put_middle_city("A", "B", 6, 8, 140,
-                                            starting_city="B",
-                                            current_datetime=datetime.datetime(
-                                                year=1, month=1, day=1))
+        middle_city = await put_middle_city("A", "B", 360, 480, 140,
+                                            starting_city="B")
         assert middle_city[0].name == 'B'
 
 
@@ -170,12 +589,7 @@ async def test_put_middle_city_distance_more_than_max_distance_nonreachable_next
     """
     with mock.patch('main.find_middle_city') as MockClass:
         MockClass.side_effect = [None, [2, 2]]
-        middle_city = await put_middle_city("A", "B", 6, 8, 140+450,
-                                            current_datetime=
-                                            datetime.datetime(
-                                                year=1,
-                                                month=1,
-                                                day=1))
+        middle_city = await put_middle_city("A", "B", 360, 480, 140+450)
         assert middle_city[0].name == 2
 
 
@@ -188,24 +602,420 @@ async def test_put_middle_city_distance_more_than_max_distance_reachable_next_ci
         MockClass1.return_value = None
         with mock.patch('main.create_excursion_city') as MockClass:
             MockClass.return_value = [1]
-            middle_city = await put_middle_city("A", "B", 6, 8, 140,
-                                                current_datetime=
-                                                datetime.datetime(
-                                                    year=1,
-                                                    month=1,
-                                                    day=1))
+            middle_city = await put_middle_city("A", "B", 360, 480, 140)
             assert middle_city[0] == 1
 
 
+def create_corridor_html(cities):
+    """
+    Создание страницы со списком городов между двумя городами
+    """
+    rows = ['<div class="cityinfo"><a href="/">' + name + '</a> <span>'
+            + str(distance) + ' km</span></div>'
+            for name, distance in cities]
+    return '<html><body>' + ''.join(rows) + '</body></html>'
+
+
+def test_parse_drive_distance():
+    """
+    Тест извлечения расстояния по дорогам из сохранённой страницы
+    """
+    with open('tests/fixtures/travelmath.html') as f:
+        assert parse_drive_distance(f.read()) == 545
+    assert parse_drive_distance('<h3 id="drivedist">Driving distance:'
+                                '<br/> 1,234 km</h3>') == 1234
+    assert parse_drive_distance('<html></html>') is None
+
+
+def test_parse_corridor():
+    """
+    Тест извлечения городов между двумя городами из сохранённой страницы
+    """
+    with open('tests/fixtures/citiesbetween.html') as f:
+        cities = parse_corridor(f.read())
+    assert len(cities) == 9
+    assert cities[0] == (35, 'Potsdam')
+    assert parse_corridor(create_corridor_html([('Gotha', 320)])) == \
+        [(320, 'Gotha')]
+
+
+def test_corridor_furthest():
+    """
+    Тест нахождения самого дальнего достижимого города
+    """
+    corridor = Corridor(['B', 'C', 'D'], [100, 200, 300])
+    assert corridor.furthest(250) == ['C', 200]
+    assert corridor.furthest(200) == ['C', 200]
+    assert corridor.furthest(50) is None
+    assert corridor.furthest(300) == ['D', 300]
+    assert corridor.furthest(1000) == ['D', 300]
+    assert corridor.nearest() == ['B', 100]
+    assert Corridor([], []).nearest() is None
+
+
+@pytest.mark.asyncio
+async def test_find_middle_city_fetches_corridor_once(tmp_path):
+    """
+    Тест однократного запроса списка городов между двумя городами
+    """
+    cache = DistanceCache(str(tmp_path / 'distances.sqlite'))
+    html = create_corridor_html([('Erfurt', 300), ('Gotha', 320),
+                                 ('Eisenach', 350)])
+    provider = ScrapingProvider(cache=cache)
+    with mock.patch('providers.fetch_text') as AsyncMock:
+        AsyncMock.return_value = html
+        first = await find_middle_city('Berlin', 'Frankfurt', 330, provider)
+        second = await find_middle_city('Berlin', 'Frankfurt', 310, provider)
+        assert AsyncMock.call_count == 1
+    assert first == ['Gotha', 320]
+    assert second == ['Erfurt', 300]
+    assert cache.get_corridor('Berlin', 'Frankfurt') == \
+        [['Erfurt', 'Gotha', 'Eisenach'], [300, 320, 350]]
+    cache.close()
+
+
+@pytest.mark.asyncio
+async def test_prefetch_corridors():
+    """
+    Тест одновременного запроса списков городов для всех пар городов
+    """
+    active = []
+    peak = []
+
+    async def fetch_text(url, fetcher):
+        active.append(url)
+        peak.append(len(active))
+        await asyncio.sleep(0.01)
+        active.remove(url)
+        return create_corridor_html([('Gotha', 320), ('Eisenach', 350)])
+
+    provider = ScrapingProvider()
+    with mock.patch('providers.fetch_text',
+                    side_effect=fetch_text) as AsyncMock:
+        provider.prefetch([('A', 'B'), ('B', 'C'), ('C', 'A')])
+        for start_city, end_city in (('A', 'B'), ('B', 'C'), ('C', 'A')):
+            assert await find_middle_city(start_city, end_city, 330,
+                                          provider) == ['Gotha', 320]
+        assert max(peak) == 3
+        assert AsyncMock.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_plan_stops_prefetches_long_legs():
+    """
+    Тест запроса заранее списков городов только для переездов
+    длиннее дневного пробега
+    """
+    async def iterate_course(*args):
+        yield City('A', None, None, 'starting point')
+
+    graph = {'A': {'B': 100, 'C': 900}, 'B': {'C': 850}}
+    provider = mock.Mock()
+    with mock.patch('main.iterate_course', iterate_course):
+        stops = [i async for i in plan_stops(
+            None, 'A', graph, datetime.datetime(2021, 11, 15), 10,
+            provider=provider, current_course=['A', 'B', 'C'])]
+    assert len(stops) == 1
+    assert list(provider.prefetch.call_args[0][0]) == [('B', 'C'),
+                                                       ('C', 'A')]
+
+
+@pytest.mark.asyncio
+async def test_scraping_provider_with_standin_server():
+    """
+    Тест запросов к локальному серверу с записанными страницами
+    """
+    async with StandinServer(latency=0.01, jitter=0.005, seed=1) as server:
+        async with Fetcher() as fetcher:
+            provider = ScrapingProvider(fetcher, None, server.distance_url,
+                                        server.corridor_url)
+            distance = await provider.distance('Berlin', 'Frankfurt')
+            corridor = await provider.corridor('Berlin', 'Frankfurt')
+        assert distance == ['Berlin', 'Frankfurt', 545]
+        assert corridor.names[0] == 'Potsdam'
+        assert server.requests == 2
+    async with StandinServer(error_rate=1) as server:
+        async with Fetcher(retries=2, backoff=0.01) as fetcher:
+            provider = ScrapingProvider(fetcher, None, server.distance_url,
+                                        server.corridor_url)
+            with pytest.raises(aiohttp.ClientResponseError):
+                await provider.distance('Berlin', 'Frankfurt')
+        assert server.errors == 3
+
+
+@pytest.mark.asyncio
+async def test_default_urls_from_configs():
+    """
+    Тест запросов по адресам из конфигурации, если адреса не переданы
+    """
+    async with StandinServer() as server:
+        with mock.patch.dict('settings.configs',
+                             {'distance url': server.distance_url,
+                              'corridor url': server.corridor_url}):
+            provider = ScrapingProvider()
+            distances = await create_distances({'Berlin': {'Frankfurt': 0}})
+            corridor = await provider.corridor('Berlin', 'Frankfurt')
+        assert distances == [['Berlin', 'Frankfurt', 545]]
+        assert corridor.names[0] == 'Potsdam'
+        assert server.requests == 2
+
+
+@pytest.mark.asyncio
+async def test_fetcher_timeout_and_hedging():
+    """
+    Тест повтора запроса после истечения времени ожидания
+    и дублирования запроса, ответ на который дольше обычного
+    """
+    async with StandinServer(latency=0.5) as server:
+        async with Fetcher(timeout=0.05, retries=1, backoff=0.01) as fetcher:
+            with pytest.raises(asyncio.TimeoutError):
+                await fetcher.get_text(server.distance_url + 'A/to/B')
+        assert server.requests == 2
+    delays = [1, 0.01]
+
+    async def request_text(host, url):
+        await asyncio.sleep(delays.pop(0))
+        return url
+
+    fetcher = Fetcher(hedge=True)
+    fetcher.latencies['example.com'] = [0.02] * 20
+    with mock.patch.object(fetcher, 'request_text',
+                           side_effect=request_text) as MockClass:
+        start = time.perf_counter()
+        assert await fetcher.get_text('http://example.com/') == \
+            'http://example.com/'
+        assert time.perf_counter() - start < 0.5
+        assert MockClass.call_count == 2
+
+
+def test_distance_provider_requires_methods():
+    """
+    Тест ошибки при создании источника без необходимых методов
+    """
+    class PartialProvider(DistanceProvider):
+        async def distance(self, start_city, end_city):
+            return [start_city, end_city, 0]
+
+    with pytest.raises(TypeError):
+        PartialProvider()
+
+
+@pytest.mark.asyncio
+async def test_gazetteer_provider():
+    """
+    Тест расчёта расстояний и городов между двумя городами без сети
+    """
+    provider = GazetteerProvider('gazetteer.csv', road_factor=1)
+    distance = await provider.distance('Berlin', 'Frankfurt')
+    assert 420 < distance[2] < 430
+    corridor = await provider.corridor('Berlin', 'Frankfurt')
+    assert 'Gotha' in corridor.names
+    assert 'Munich' not in corridor.names
+    assert corridor.distances == sorted(corridor.distances)
+    graph = await create_graph(['Berlin', 'Erfurt', 'Frankfurt'],
+                               provider=provider)
+    assert graph['Berlin']['Frankfurt'] == distance[2]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('solver', ['brute_force', 'held_karp', 'heuristic',
+                                    'schedule'])
+async def test_plan_long_legs_with_gazetteer(tmp_path, solver):
+    """
+    Тест расчёта маршрута без сети с переездами длиннее дня за рулём
+    """
+    input_file = tmp_path / 'excursions.csv'
+    input_file.write_text('Name,City,Start time,Duration\n'
+                          'Old town,Munich,"10:00, 14:00",2h\n'
+                          'Harbour,Hamburg,"10:00",1h\n'
+                          'Cathedral,Cologne,"12:00",1h\n')
+    provider = create_provider('gazetteer.csv', None, None)
+    excursions = get_excursions(str(input_file))
+    cities = [i.city for i in excursions] + ['Berlin']
+    graph = DistanceMatrix.from_graph(await create_graph(cities,
+                                                         provider=provider))
+    course = await plan_course(excursions, 'Berlin', graph,
+                               datetime.datetime(2021, 11, 15), 10, solver,
+                               provider)
+    names = [i.name for i in course]
+    assert names[0] == names[-1] == 'Berlin'
+    assert {'Munich', 'Hamburg', 'Cologne'} <= set(names)
+    assert 'Stopping point' in [i.stop_name for i in course]
+
+
+@pytest.mark.asyncio
+async def test_plan_batch(tmp_path):
+    """
+    Тест расчёта нескольких поездок по одному общему графу
+    """
+    with open(tmp_path / 'first.csv', 'w') as f:
+        f.write('Name,City,Start time,Duration\n'
+                'Auto museum,Frankfurt,"10:00, 12:00, 14:00",2h\n'
+                'Old town,Erfurt,"09:00, 15:00",1h\n')
+    with open(tmp_path / 'second.csv', 'w') as f:
+        f.write('Name,City,Start time,Duration\n'
+                'Zoo,Leipzig,"10:00, 13:00",3h\n')
+    with open(tmp_path / 'manifest.csv', 'w') as f:
+        f.write('input_file,starting_city,start_date,output_file\n')
+        for name, city, date in (('first', 'Berlin', '2021,11,15,10:00'),
+                                 ('second', 'Dresden', 'tomorrow'),
+                                 ('missing', 'Jena', '2021,11,15,10:00'),
+                                 ('first', 'Kassel', '2021,11,15,10:00')):
+            f.write('{0}/{1}.csv,{2},"{3}",{0}/{2}.out\n'
+                    .format(tmp_path, name, city, date))
+    with mock.patch('batch.create_graph',
+                    side_effect=create_graph) as MockGraph:
+        results = await plan_batch(str(tmp_path / 'manifest.csv'),
+                                   gazetteer='gazetteer.csv')
+        MockGraph.assert_called_once()
+    assert isinstance(results[1], IndexError)
+    assert isinstance(results[2], OSError)
+    for index, city in ((0, 'Berlin'), (3, 'Kassel')):
+        with open(tmp_path / (city + '.out')) as csvfile:
+            rows = list(csv.reader(csvfile))
+        assert results[index] == len(rows) - 1
+        assert rows[1][0] == rows[-1][0] == city
+        assert 'Auto museum' in [i[3] for i in rows]
+
+
+@pytest.mark.asyncio
+async def test_plan_batch_falls_back_to_job_graphs(tmp_path):
+    """
+    Тест расчёта поездок по отдельным графам, если общий граф
+    построить не удалось
+    """
+    with open(tmp_path / 'first.csv', 'w') as f:
+        f.write('Name,City,Start time,Duration\n'
+                'Auto museum,Frankfurt,"10:00, 12:00, 14:00",2h\n')
+    with open(tmp_path / 'manifest.csv', 'w') as f:
+        f.write('input_file,starting_city,start_date,output_file\n')
+        for city in ('Berlin', 'Atlantis'):
+            f.write('{0}/first.csv,{1},"2021,11,15,10:00",{0}/{1}.out\n'
+                    .format(tmp_path, city))
+    with mock.patch('batch.create_graph',
+                    side_effect=create_graph) as MockGraph:
+        results = await plan_batch(str(tmp_path / 'manifest.csv'),
+                                   gazetteer='gazetteer.csv')
+        assert MockGraph.call_count == 3
+    assert isinstance(results[1], KeyError)
+    with open(tmp_path / 'Berlin.out') as csvfile:
+        rows = list(csv.reader(csvfile))
+    assert results[0] == len(rows) - 1
+    assert 'Auto museum' in [i[3] for i in rows]
+
+
+@pytest.mark.asyncio
+async def test_planner_service():
+    """
+    Тест одновременных заданий сервису и повторного задания
+    без запроса расстояний
+    """
+    job = {'input_file': 'excursions.csv', 'starting_city': 'Berlin',
+           'start_date': '2021,11,15,10:00'}
+    inline = {'excursions': [{'name': 'Tour', 'city': 'Leipzig',
+                              'start_time': '10:00, 15:00',
+                              'duration': '2h'},
+                             {'name': 'Zoo', 'city': 'Dresden',
+                              'start_time': '09:00', 'duration': '3h'}],
+              'starting_city': 'Berlin', 'start_date': '2021,11,15,10:00'}
+    async with PlannerService(gazetteer='gazetteer.csv') as service:
+        async with aiohttp.ClientSession() as session:
+            async def post(data):
+                async with session.post(service.url + 'plan',
+                                        json=data) as response:
+                    return response.status, await response.json()
+
+            first, second = await asyncio.gather(post(job), post(inline))
+            with mock.patch.object(service.provider, 'distance') as MockClass:
+                repeat = await post(job)
+                assert MockClass.call_count == 0
+            async with session.post(service.url + 'plan', json={
+                    'starting_city': 'Berlin'}) as response:
+                assert response.status == 400
+
+            async def failing_distance(start_city, end_city):
+                return None
+
+            unknown = dict(inline, excursions=[dict(
+                inline['excursions'][0], city='Weimar')])
+            with mock.patch.object(service.provider, 'distance',
+                                   side_effect=failing_distance):
+                async with session.post(service.url + 'plan',
+                                        json=unknown) as response:
+                    assert response.status == 502
+            assert ('Berlin', 'Weimar') not in service.distances
+    assert first[0] == 200
+    assert first == repeat
+    assert first[1][0]['Название города'] == 'Berlin'
+    assert first[1][-1]['Экскурсия/остановка'] == 'Ending point'
+    assert sorted({i['Название города'] for i in second[1]}) == \
+        ['Berlin', 'Dresden', 'Leipzig']
+
+
+@pytest.mark.asyncio
+async def test_planner_service_reuses_tours():
+    """
+    Тест повторного использования маршрута, найденного для первого задания
+    """
+    job = {'excursions': [{'name': 'Tour', 'city': 'Leipzig',
+                           'start_time': '10:00', 'duration': '2h'},
+                          {'name': 'Zoo', 'city': 'Dresden',
+                           'start_time': '09:00', 'duration': '3h'}],
+           'starting_city': 'Berlin', 'start_date': '2021,11,15,10:00'}
+    with mock.patch.dict('courses.SOLVERS', {'brute_force': mock.Mock(
+            side_effect=brute_force_course)}) as solvers:
+        async with PlannerService(gazetteer='gazetteer.csv') as service:
+            async with aiohttp.ClientSession() as session:
+                for i in range(2):
+                    async with session.post(service.url + 'plan',
+                                            json=job) as response:
+                        assert response.status == 200
+        assert solvers['brute_force'].call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_planner_service_bounded_memory(tmp_path):
+    """
+    Тест ограничения хранимых сервисом данных и ответа 502
+    при ошибке сети
+    """
+    input_file = tmp_path / 'excursions.csv'
+    input_file.write_text('Name,City,Start time,Duration\n'
+                          'Tour,Leipzig,"10:00",2h\n'
+                          'Zoo,Dresden,"09:00",3h\n')
+    job = {'input_file': str(input_file), 'starting_city': 'Berlin',
+           'start_date': '2021,11,15,10:00'}
+    service = PlannerService(gazetteer='gazetteer.csv')
+    service.size = 2
+    async with service:
+        async with aiohttp.ClientSession() as session:
+            async def post():
+                async with session.post(service.url + 'plan',
+                                        json=job) as response:
+                    return response.status
+
+            assert await post() == 200
+            assert len(service.distances) <= 2
+            assert len(service.provider.corridors) <= 2
+            os.utime(input_file, (1, 1))
+            assert await post() == 200
+            assert list(service.excursions) == [str(input_file)]
+            job['starting_city'] = 'Jena'
+            with mock.patch.object(service.provider, 'distance',
+                                   side_effect=aiohttp.ClientError):
+                assert await post() == 502
+
+
 def test_create_excursion_city():
     """
     Тест создания информации о городе с экскурсией
     """
     excursions = [Excursion('Best churches', 'Berlin', '09:00, 14:00, 16:00',
                             '4h')]
-    city = create_excursion_city("Berlin", excursions, 10, 70, 3,
-                                 datetime.datetime(year=1, month=1, day=1))
+    city = create_excursion_city("Berlin", excursions, 600, 70, 180)
     assert city[0].name == 'Berlin'
+    assert city[0].arrival == 660
+    assert city[1] == [240, 1080]
 
 
 @pytest.mark.asyncio
@@ -214,16 +1024,11 @@ async def test_create_course_without_middle_cities():
     Тест создания тура без промежуточных городов
     """
     with mock.patch('main.put_middle_city') as MockClass:
-        MockClass.return_value = [City(2, 1, 1, 'B'), [None, None, None, None]]
+        MockClass.return_value = [City(2, 1, 1, 'B'), [None, None, None]]
         current_course = [1, 2]
         current_course = await \
             create_course_with_middle_cities(current_course, None, None,
-                                             current_datetime=
-                                             datetime.datetime(
-                                                 year=1,
-                                                 month=1,
-                                                 day=1),
-                                             current_time=8)
+                                             current_time=480)
         assert current_course[0][1].name == 2
 
 
@@ -234,18 +1039,13 @@ async def test_create_course_with_middle_cities():
     """
     with mock.patch('main.put_middle_city') as MockClass:
         MockClass.side_effect = [[City(3, 1, 1, 'Stop'),
-                                  [None, None, None, None]],
+                                  [None, None, None]],
                                  [City(2, 1, 1, 'B'),
-                                  [None, None, None, None]]]
+                                  [None, None, None]]]
         current_course = [1, 2]
         current_course = await \
             create_course_with_middle_cities(current_course, None, None,
-                                             current_datetime=
-                                             datetime.datetime(
-                                                 year=1,
-                                                 month=1,
-                                                 day=1),
-                                             current_time=8)
+                                             current_time=480)
         assert current_course[0][1].name == 3
 
 
@@ -261,8 +1061,8 @@ async def test_complete_course_without_middle_city():
         with mock.patch('main.put_middle_city') as MockClass1:
             MockClass1.return_value = (City(1, 1, 1, 1), 3)
             current_course = [City(2, 1, 1, 1)]
-            current_course = await complete_course(current_course, 0, 8, 1,
-                                                   graph, None)
+            current_course = await complete_course(current_course, 0, 480,
+                                                   1, graph)
             assert current_course[1].name == 1
 
 
@@ -276,10 +1076,9 @@ async def test_complete_course_with_middle_cities():
         cities = [1, 2, 3]
         graph = await create_graph(cities)
         with mock.patch('main.put_middle_city') as MockClass1:
-            MockClass1.side_effect = ([City(3, 1, 1, 1), [3, None, None,
-                                                          None]],
+            MockClass1.side_effect = ([City(3, 1, 1, 1), [3, None, None]],
                                       [City(1, 1, 1, 1), None])
             current_course = [City(1, 1, 1, 1), City(2, 1, 1, 1)]
             current_course = await complete_course(current_course, 0,
-                                                   8, 1, graph, None)
+                                                   480, 1, graph)
             assert current_course[2].name == 3